@@ -1,12 +1,48 @@
+import json
 import os
 
-from aiohttp import ClientSession
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
 from cryptography.fernet import Fernet
 
+from client.utils import config
+
+CONNECTIONS_LIMIT = config.getint("api", "CONNECTIONS_LIMIT")
+CONNECTIONS_LIMIT_PER_HOST = config.getint("api", "CONNECTIONS_LIMIT_PER_HOST")
+KEEPALIVE_TIMEOUT = config.getfloat("api", "KEEPALIVE_TIMEOUT")
+TOTAL_TIMEOUT = config.getfloat("api", "TOTAL_TIMEOUT")
+CONNECT_TIMEOUT = config.getfloat("api", "CONNECT_TIMEOUT")
+STREAM_READ_TIMEOUT = config.getfloat("api", "STREAM_READ_TIMEOUT")
+PROGRESS_TIMEOUT = config.getfloat("api", "PROGRESS_TIMEOUT")
+
 
 class Api:
     _cipher = Fernet(os.getenv("CIPHER"))
     _address = os.getenv("BACKEND")
+    _client_session: ClientSession | None = None
+
+    @classmethod
+    def _session(cls):
+        """
+        One session (and so one connection pool) for whole bot process.
+        Created lazily, because ClientSession must be bound to running event loop.
+        """
+        if cls._client_session is None or cls._client_session.closed:
+            cls._client_session = ClientSession(
+                cls._address,
+                connector=TCPConnector(
+                    limit=CONNECTIONS_LIMIT,
+                    limit_per_host=CONNECTIONS_LIMIT_PER_HOST,
+                    keepalive_timeout=KEEPALIVE_TIMEOUT,
+                ),
+                timeout=ClientTimeout(total=TOTAL_TIMEOUT, connect=CONNECT_TIMEOUT),
+            )
+        return cls._client_session
+
+    @classmethod
+    async def close(cls):
+        if cls._client_session is not None and not cls._client_session.closed:
+            await cls._client_session.close()
+        cls._client_session = None
 
     @classmethod
     def _headers(cls):
@@ -18,116 +54,167 @@ class Api:
 
     @classmethod
     async def add_user(cls, user_id: str):
-        async with ClientSession(cls._address) as session:
-            async with session.post(
-                "/users", json={"user_id": user_id}, headers=cls._headers()
-            ) as response:
-                return await response.json(), response.status
+        async with cls._session().post(
+            "/users", json={"user_id": user_id}, headers=cls._headers()
+        ) as response:
+            return await response.json(), response.status
+
+    @classmethod
+    def encrypt(cls, data: str):
+        return cls._cipher.encrypt(data.encode()).decode()
 
     @classmethod
     async def get_user(cls, user_id: str):
-        async with ClientSession(cls._address) as session:
-            async with session.get(
-                f"/users/{cls._cipher.encrypt(str(user_id).encode()).decode()}",
-                headers=cls._headers(),
-            ) as response:
-                return await response.json(), response.status
+        async with cls._session().get(
+            f"/users/{cls.encrypt(str(user_id))}",
+            headers=cls._headers(),
+        ) as response:
+            return await response.json(), response.status
 
     @classmethod
     async def authentication(cls, user_id: str, password: str | None = None):
-        async with ClientSession(cls._address) as session:
-            async with session.post(
-                "/users/login",
-                json={
-                    "user_id": user_id,
-                    "password": password,
-                },
-                headers=cls._headers(),
-            ) as response:
-                return await response.json(), response.status
-
-    @classmethod
-    async def get_targets(cls, token: str):
+        async with cls._session().post(
+            "/users/login",
+            json={
+                "user_id": user_id,
+                "password": password,
+            },
+            headers=cls._headers(),
+        ) as response:
+            return await response.json(), response.status
+
+    @classmethod
+    async def get_targets(
+        cls,
+        token: str,
+        *,
+        after_id: int | None = None,
+        before_id: int | None = None,
+        limit: int | None = None,
+    ):
+        """
+        Without limit returns list of all targets, with limit returns page:
+        {"targets", "total", "achieved", "has_before", "has_after"}
+        """
         headers = cls._headers()
         headers["Authorization"] = f"Bearer {token}"
-        async with ClientSession(cls._address) as session:
-            async with session.get(f"/targets", headers=headers) as response:
-                return await response.json(), response.status
+        params = {
+            key: value
+            for key, value in (
+                ("after_id", after_id),
+                ("before_id", before_id),
+                ("limit", limit),
+            )
+            if value is not None
+        }
+        async with cls._session().get(
+            "/targets/", params=params, headers=headers
+        ) as response:
+            return await response.json(), response.status
 
     @classmethod
     async def invert_notifications(cls, user_id: str):
-        async with ClientSession(cls._address) as session:
-            async with session.patch(
-                "/users/notifications",
-                json={"user_id": user_id},
-                headers=cls._headers(),
-            ) as response:
-                return await response.json(), response.status
-
-    @classmethod
-    async def increase_progress(cls):
-        async with ClientSession(cls._address) as session:
-            async with session.patch(
-                f"/targets/progress", headers=cls._headers()
-            ) as response:
-                return await response.json(), response.status
-
-    @classmethod
-    async def get_users(cls):
-        async with ClientSession(cls._address) as session:
-            async with session.get(f"/users", headers=cls._headers()) as response:
-                return await response.json(), response.status
-
-    @classmethod
-    async def update_password(cls, user_id: str, hash_: str):
-        async with ClientSession(cls._address) as session:
-            async with session.put(
-                f"/users/password",
-                json={
-                    "user_id": user_id,
-                    "hash": hash_,
-                },
-                headers=cls._headers(),
-            ) as response:
-                return await response.json(), response.status
+        async with cls._session().patch(
+            "/users/notifications",
+            json={"user_id": user_id},
+            headers=cls._headers(),
+        ) as response:
+            return await response.json(), response.status
+
+    @classmethod
+    def increase_progress(cls):
+        """
+        Yields notifications states of users whose targets were reopened.
+        Rollover of all targets is done by batches and lasts longer than
+        TOTAL_TIMEOUT on large tables, so it has its own PROGRESS_TIMEOUT
+        """
+        return cls._stream(
+            "/targets/progress",
+            "PATCH",
+            ClientTimeout(total=PROGRESS_TIMEOUT, connect=CONNECT_TIMEOUT),
+        )
+
+    @classmethod
+    async def _stream(
+        cls, path: str, method: str = "GET", timeout: ClientTimeout | None = None
+    ):
+        """
+        Yields objects while NDJSON stream is read.
+        Raises ClientResponseError on unexpected status.
+        By default stream isn't limited in total time, only in time between reads.
+        """
+        async with cls._session().request(
+            method,
+            path,
+            headers=cls._headers(),
+            timeout=timeout
+            or ClientTimeout(
+                total=None, connect=CONNECT_TIMEOUT, sock_read=STREAM_READ_TIMEOUT
+            ),
+        ) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                if line.strip():
+                    yield json.loads(line)
+
+    @classmethod
+    def get_users(cls):
+        return cls._stream("/users/")
+
+    @classmethod
+    def get_notifications_states(cls):
+        return cls._stream("/users/notifications")
+
+    @classmethod
+    async def update_password(cls, user_id: str, encrypted_password: str):
+        """
+        Password is hashed by backend, it gets password encrypted by encrypt()
+        """
+        async with cls._session().put(
+            f"/users/password",
+            json={
+                "user_id": user_id,
+                "password": encrypted_password,
+            },
+            headers=cls._headers(),
+        ) as response:
+            return await response.json(), response.status
 
     @classmethod
     async def delete_password(cls, token: str):
         headers = cls._headers()
         headers["Authorization"] = f"Bearer {token}"
-        async with ClientSession(cls._address) as session:
-            async with session.delete(f"/users/password", headers=headers) as response:
-                return await response.json(), response.status
+        async with cls._session().delete(
+            f"/users/password", headers=headers
+        ) as response:
+            return await response.json(), response.status
 
     @classmethod
     async def update_email(cls, token: str, email: str):
         headers = cls._headers()
         headers["Authorization"] = f"Bearer {token}"
-        async with ClientSession(cls._address) as session:
-            async with session.put(
-                f"/users/email", json={"email": email}, headers=headers
-            ) as response:
-                return await response.json(), response.status
+        async with cls._session().put(
+            f"/users/email", json={"email": email}, headers=headers
+        ) as response:
+            return await response.json(), response.status
 
     @classmethod
     async def delete_email(cls, token: str):
         headers = cls._headers()
         headers["Authorization"] = f"Bearer {token}"
-        async with ClientSession(cls._address) as session:
-            async with session.delete(f"/users/email", headers=headers) as response:
-                return await response.json(), response.status
+        async with cls._session().delete(f"/users/email", headers=headers) as response:
+            return await response.json(), response.status
 
     @classmethod
     async def update_notifications_time(cls, token: str, hour: int, minute: int):
         headers = cls._headers()
         headers["Authorization"] = f"Bearer {token}"
-        async with ClientSession(cls._address) as session:
-            async with session.put(
-                "/users/notifications",
-                json={"hour": hour, "minute": minute},
-                headers=headers,
-            ) as response:
-                return await response.json(), response.status
+        async with cls._session().put(
+            "/users/notifications",
+            json={"hour": hour, "minute": minute},
+            headers=headers,
+        ) as response:
+            return await response.json(), response.status
 
     @classmethod
     async def create_target(
@@ -135,47 +222,43 @@ class Api:
     ):
         headers = cls._headers()
         headers["Authorization"] = f"Bearer {token}"
-        async with ClientSession(cls._address) as session:
-            async with session.post(
-                "/targets",
-                json={
-                    "name": name,
-                    "border_progress": border_progress,
-                    "description": description,
-                },
-                headers=headers,
-            ) as response:
-                return await response.json(), response.status
+        async with cls._session().post(
+            "/targets",
+            json={
+                "name": name,
+                "border_progress": border_progress,
+                "description": description,
+            },
+            headers=headers,
+        ) as response:
+            return await response.json(), response.status
 
     @classmethod
     async def delete_target(cls, token: str, target_id: int):
         headers = cls._headers()
         headers["Authorization"] = f"Bearer {token}"
-        async with ClientSession(cls._address) as session:
-            async with session.delete(
-                f"/targets/{target_id}", headers=headers
-            ) as response:
-                return await response.json(), response.status
+        async with cls._session().delete(
+            f"/targets/{target_id}", headers=headers
+        ) as response:
+            return await response.json(), response.status
 
     @classmethod
     async def get_target(cls, token: str, target_id: int):
         headers = cls._headers()
         headers["Authorization"] = f"Bearer {token}"
-        async with ClientSession(cls._address) as session:
-            async with session.get(
-                f"/targets/{target_id}", headers=headers
-            ) as response:
-                return await response.json(), response.status
+        async with cls._session().get(
+            f"/targets/{target_id}", headers=headers
+        ) as response:
+            return await response.json(), response.status
 
     @classmethod
     async def invert_completed(cls, token: str, target_id: int):
         headers = cls._headers()
         headers["Authorization"] = f"Bearer {token}"
-        async with ClientSession(cls._address) as session:
-            async with session.patch(
-                f"/targets/{target_id}/invert", headers=headers
-            ) as response:
-                return await response.json(), response.status
+        async with cls._session().patch(
+            f"/targets/{target_id}/invert", headers=headers
+        ) as response:
+            return await response.json(), response.status
 
     @classmethod
     async def update_target(
@@ -188,10 +271,9 @@ class Api:
     ):
         headers = cls._headers()
         headers["Authorization"] = f"Bearer {token}"
-        async with ClientSession(cls._address) as session:
-            async with session.put(
-                f"/targets/{target_id}",
-                json={"name": name, "description": description},
-                headers=headers,
-            ) as response:
-                return await response.json(), response.status
+        async with cls._session().put(
+            f"/targets/{target_id}",
+            json={"name": name, "description": description},
+            headers=headers,
+        ) as response:
+            return await response.json(), response.status
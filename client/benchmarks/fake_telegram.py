@@ -0,0 +1,68 @@
+"""
+Fake Bot API server, drives the bot locally without Telegram.
+Bot is pointed to it by TELEGRAM_API=FakeTelegram.address before client.bot import.
+Every method succeeds, sent messages get new ids, calls are counted by method.
+"""
+
+import asyncio
+import itertools
+import time
+from collections import Counter
+
+from aiohttp import web
+
+
+class FakeTelegram:
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081):
+        self.host = host
+        self.port = port
+        self.calls: Counter[str] = Counter()
+        self._message_ids = itertools.count(1)
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def address(self):
+        return f"http://{self.host}:{self.port}"
+
+    def _message(self, chat_id: str, text: str):
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "text": text,
+        }
+
+    async def _handle(self, request: web.Request):
+        method = request.match_info["method"]
+        data = await request.post()
+        self.calls[method] += 1
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bot", "username": "bot"}
+        elif method == "sendMessage":
+            result = self._message(data["chat_id"], data.get("text", ""))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def wait_calls(self, method: str, count: int, timeout: float = 10):
+        """
+        Waits until method is called count times, returns False on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while self.calls[method] < count:
+            if time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return True
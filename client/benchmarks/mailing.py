@@ -0,0 +1,128 @@
+"""
+Messages per second of verify code mails sent with connection per mail,
+through SMTPPool and end to end through redis queue and Mailing workers.
+Mails go to local aiosmtpd server (dev dependency), queue and storage are kept
+in separate redis database BENCHMARK_DB, it is flushed.
+Local server has no TLS and network, so real server widens the gap.
+
+python -m client.benchmarks.mailing [mails]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from aiosmtpd.controller import Controller
+
+SMTP_HOST = "127.0.0.1"
+SMTP_PORT = 8025
+os.environ.update(SMTP_SERVER=SMTP_HOST, SMTP_PORT=str(SMTP_PORT), SMTP_TLS="false")
+os.environ.setdefault("ORGANIZATION_EMAIL", "bot@mail.ru")
+# Local server doesn't need login
+os.environ.pop("SMTP_PASSWORD", None)
+
+import aiosmtplib
+
+import client.bot  # markups can't be imported before bot, import is circular
+from client.utils.mailing import (
+    Mailing,
+    SMTPPool,
+    MAIL_ADDRESS,
+    POOL_SIZE,
+    WORKERS,
+)
+from client.utils.redis import CustomRedis, Storage
+
+BENCHMARK_DB = 15
+RECEIVER = "user@mail.ru"
+
+
+class CountingHandler:
+    def __init__(self):
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        return "250 OK"
+
+
+def _mail(n: int):
+    return {
+        "user_id": n,
+        "receiver": RECEIVER,
+        "subject": "Verify",
+        "name": "Name",
+        "verify_code": f"{n:06}",
+    }
+
+
+async def _connection_per_mail(mails: int):
+    limit = asyncio.Semaphore(POOL_SIZE)
+
+    async def send(n: int):
+        async with limit:
+            async with aiosmtplib.SMTP(hostname=SMTP_HOST, port=SMTP_PORT) as smtp:
+                await smtp.sendmail(MAIL_ADDRESS, RECEIVER, Mailing._message(_mail(n)))
+
+    await asyncio.gather(*(send(n) for n in range(mails)))
+
+
+async def _pool(mails: int):
+    await asyncio.gather(
+        *(SMTPPool.send(RECEIVER, Mailing._message(_mail(n))) for n in range(mails))
+    )
+    await SMTPPool.close()
+
+
+async def _queue(mails: int):
+    delivered = asyncio.Event()
+    notified = 0
+
+    async def notify(mail, is_delivered):
+        nonlocal notified
+        notified += 1
+        if notified == mails:
+            delivered.set()
+
+    for n in range(mails):
+        storage = await Storage(n).load()
+        await Mailing.send_verify_code(storage, RECEIVER, "Verify", "Name")
+    serve = asyncio.create_task(Mailing.serve(notify))
+    await delivered.wait()
+    serve.cancel()
+    await asyncio.gather(serve, return_exceptions=True)
+
+
+async def _measure(title: str, send, mails: int, handler: CountingHandler):
+    handler.received = 0
+    start = time.perf_counter()
+    await send(mails)
+    elapsed = time.perf_counter() - start
+    print(
+        f"--- {title}: {handler.received / elapsed:.0f} msg/s,"
+        f" {handler.received} of {mails} received in {elapsed:.2f}s"
+    )
+
+
+async def main(mails: int = 1000):
+    handler = CountingHandler()
+    controller = Controller(handler, hostname=SMTP_HOST, port=SMTP_PORT)
+    controller.start()
+    Mailing._redis = Storage.storage = CustomRedis(
+        host=os.getenv("REDIS_HOST"), port=int(os.getenv("REDIS_PORT")), db=BENCHMARK_DB
+    )
+    await Mailing._redis.flushdb()
+    print(f"=== {mails} mails, {POOL_SIZE} connections, {WORKERS} workers")
+    try:
+        await _measure("Connection per mail", _connection_per_mail, mails, handler)
+        await _measure("SMTPPool", _pool, mails, handler)
+        await _measure("Queue and workers", _queue, mails, handler)
+    finally:
+        await Mailing._redis.flushdb()
+        await Mailing._redis.aclose()
+        controller.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,66 @@
+"""
+Size and encode/decode time of session values with pickle and msgpack.
+Pickle gets context as it was stored before, with initializer class,
+msgpack gets context with registered initializer name.
+
+python -m client.benchmarks.serializers [rounds]
+"""
+
+import sys
+import time
+
+import client.bot  # markups can't be imported before bot, import is circular
+from client.markups.specific import Profile
+from client.utils.redis import serializers
+
+TOKEN = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9." * 4
+
+
+def _session(context_initializer):
+    return {
+        "context": (context_initializer(Profile), (TOKEN, "Name"), {}),
+        "first_name": "Name",
+        "user_token": TOKEN,
+        "hour": 15,
+        "message_ids_pull": [4815, 4816, 4817],
+        "email": "user@mail.ru",
+        "verify_code": 482913,
+        "hash": "$pbkdf2-sha256$29000$" + "N" * 22 + "$" + "x" * 43,
+        "target_id": 42,
+        "target_name": "Read book",
+        "target_description": "Twenty pages every day before sleep",
+    }
+
+
+def _measure(serializer, session: dict, rounds: int):
+    size = sum(len(serializer.dumps(value)) for value in session.values())
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        dumped = [serializer.dumps(value) for value in session.values()]
+    dumps_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for data in dumped:
+            serializer.loads(data)
+    loads_elapsed = time.perf_counter() - start
+
+    per_session = 10**6 / rounds
+    print(
+        f"--- {serializer.__name__}: {size} B per session,"
+        f" dumps {dumps_elapsed * per_session:.1f} us,"
+        f" loads {loads_elapsed * per_session:.1f} us"
+    )
+
+
+def main(rounds: int = 100_000):
+    print(f"=== {rounds} rounds")
+    _measure(serializers["pickle"], _session(lambda cls: cls), rounds)
+    _measure(
+        serializers["msgpack"], _session(lambda cls: cls.initializer_name), rounds
+    )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,103 @@
+"""
+Redis memory of sessions in old layout of key per field
+and in hash per user (plus message ids list) layout of Storage.
+Seeds separate redis database BENCHMARK_DB, it is flushed.
+
+python -m client.benchmarks.storage [users]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from redis.asyncio import Redis
+
+from client.utils.redis import Storage, CustomRedis
+
+BENCHMARK_DB = 15
+BATCH = 1000
+
+
+def _session(user_id: int):
+    return {
+        "context": ("Profile", ("eyJhbGciOiJIUzI1NiJ9." * 8, "Name"), {}),
+        "first_name": "Name",
+        "user_token": "eyJhbGciOiJIUzI1NiJ9." * 8,
+        "hour": 15,
+        "message_ids_pull": [user_id * 10 + i for i in range(3)],
+        "email": f"user{user_id}@mail.ru",
+        "target_id": user_id,
+        "target_name": "Read book",
+    }
+
+
+async def _used_memory(redis: Redis):
+    return (await redis.info("memory"))["used_memory"]
+
+
+async def _seed_keys(redis: CustomRedis, users: int):
+    for start in range(0, users, BATCH):
+        pipeline = redis.pipeline(transaction=False)
+        for user_id in range(start, min(start + BATCH, users)):
+            for field, value in _session(user_id).items():
+                pipeline.set(f"{Storage._keys[field]}:{user_id}", redis.dumps(value))
+        await pipeline.execute()
+
+
+async def _seed_hashes(redis: CustomRedis, users: int):
+    for start in range(0, users, BATCH):
+        pipeline = redis.pipeline(transaction=False)
+        for user_id in range(start, min(start + BATCH, users)):
+            session = _session(user_id)
+            pipeline.rpush(f"message_ids:{user_id}", *session.pop("message_ids_pull"))
+            pipeline.hset(
+                f"session:{user_id}",
+                mapping={field: redis.dumps(value) for field, value in session.items()},
+            )
+        await pipeline.execute()
+
+
+async def _load_keys(redis: CustomRedis, users: int):
+    for user_id in range(users):
+        await redis.mget(
+            [f"{prefix}:{user_id}" for prefix in Storage._keys.values()]
+        )
+
+
+async def _load_hashes(redis: CustomRedis, users: int):
+    for user_id in range(users):
+        pipeline = redis.pipeline(transaction=False)
+        pipeline.hgetall(f"session:{user_id}")
+        pipeline.lrange(f"message_ids:{user_id}", 0, -1)
+        await pipeline.execute()
+
+
+async def _measure(redis: CustomRedis, title: str, seed, load, users: int):
+    await redis.flushdb()
+    before = await _used_memory(redis)
+    await seed(redis, users)
+    used = await _used_memory(redis) - before
+    loaded = min(users, 10_000)
+    start = time.perf_counter()
+    await load(redis, loaded)
+    elapsed = time.perf_counter() - start
+    print(
+        f"--- {title}: {used / 2**20:.1f} MiB, {used / users:.0f} B per user,"
+        f" load {elapsed / loaded * 10**6:.0f} us per user"
+    )
+
+
+async def main(users: int = 100_000):
+    redis = CustomRedis(
+        host=os.getenv("REDIS_HOST"), port=int(os.getenv("REDIS_PORT")), db=BENCHMARK_DB
+    )
+    print(f"=== {users} users")
+    await _measure(redis, "Key per field", _seed_keys, _load_keys, users)
+    await _measure(redis, "Hash per user", _seed_hashes, _load_hashes, users)
+    await redis.flushdb()
+    await redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*map(int, sys.argv[1:])))
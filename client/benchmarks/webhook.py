@@ -0,0 +1,140 @@
+"""
+Webhook mode driven by local FakeTelegram. Checks that request without secret
+token gets 401 and update with it is handled, then measures updates per second
+sent by MAX_CONNECTIONS connections, as Telegram does, and handled by bot
+with MAX_IN_FLIGHT updates at once. Every update is /exit of separate user.
+Sessions and FSM are kept in separate redis database BENCHMARK_DB, it is flushed.
+
+python -m client.benchmarks.webhook [updates]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from aiohttp import ClientSession, ClientConnectorError
+
+from client.benchmarks.fake_telegram import FakeTelegram
+
+WEBHOOK_HOST = "127.0.0.1"
+WEBHOOK_PORT = 8082
+SECRET = "benchmark"
+TELEGRAM = FakeTelegram()
+os.environ.update(
+    TELEGRAM_API=TELEGRAM.address,
+    WEBHOOK_URL=f"http://{WEBHOOK_HOST}:{WEBHOOK_PORT}",
+    WEBHOOK_SECRET=SECRET,
+)
+
+from aiogram.fsm.storage.redis import RedisStorage
+from redis.asyncio import Redis
+
+import client.bot.webhook as webhook
+from client.bot import BotControl
+from client.bot.dispatcher import dispatcher
+from client.bot.webhook import MAX_CONNECTIONS, MAX_IN_FLIGHT, WEBHOOK_PATH
+from client.utils.redis import CustomRedis, Storage
+
+BENCHMARK_DB = 15
+URL = f"http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+
+
+def _update(n: int):
+    user = {"id": n, "is_bot": False, "first_name": "Name"}
+    return {
+        "update_id": n,
+        "message": {
+            "message_id": n,
+            "date": int(time.time()),
+            "chat": {"id": n, "type": "private"},
+            "from": user,
+            "text": "/exit",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 5}],
+        },
+    }
+
+
+async def _post(session: ClientSession, n: int, secret: str | None = SECRET):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    async with session.post(URL, json=_update(n), headers=headers) as response:
+        return response.status
+
+
+async def _wait_serving(session: ClientSession):
+    while True:
+        try:
+            async with session.get(URL):
+                return
+        except ClientConnectorError:
+            await asyncio.sleep(0.05)
+
+
+async def _check(session: ClientSession):
+    status = await _post(session, 1, secret=None)
+    assert status == 401, f"Request without secret token got {status}"
+    print("--- Without secret token: 401")
+    status = await _post(session, 1)
+    assert status == 200, f"Update got {status}"
+    # Reply is the last call of /exit handler
+    assert await TELEGRAM.wait_calls("sendMessage", 1), "Update isn't handled"
+    print(f"--- With secret token: 200, handled, calls {dict(TELEGRAM.calls)}")
+
+
+async def _measure(session: ClientSession, updates: int):
+    handled = TELEGRAM.calls["sendMessage"]
+    limit = asyncio.Semaphore(MAX_CONNECTIONS)
+
+    async def send(n: int):
+        async with limit:
+            return await _post(session, n)
+
+    start = time.perf_counter()
+    statuses = await asyncio.gather(*(send(n) for n in range(2, updates + 2)))
+    await TELEGRAM.wait_calls("sendMessage", handled + updates, timeout=600)
+    elapsed = time.perf_counter() - start
+    print(
+        f"--- {updates / elapsed:.0f} updates/s,"
+        f" {TELEGRAM.calls['sendMessage'] - handled} of {updates} handled"
+        f" in {elapsed:.2f}s, errors {sum(status != 200 for status in statuses)}"
+    )
+
+
+async def main(updates: int = 1000):
+    redis = CustomRedis(
+        host=os.getenv("REDIS_HOST"), port=int(os.getenv("REDIS_PORT")), db=BENCHMARK_DB
+    )
+    Storage.storage = redis
+    # FSM keeps its own format, not one of CustomRedis serializer
+    dispatcher.fsm.storage = RedisStorage(
+        Redis(
+            host=os.getenv("REDIS_HOST"),
+            port=int(os.getenv("REDIS_PORT")),
+            db=BENCHMARK_DB,
+        )
+    )
+    await redis.flushdb()
+    webhook.WEBHOOK_HOST, webhook.WEBHOOK_PORT = WEBHOOK_HOST, WEBHOOK_PORT
+    await TELEGRAM.start()
+    serve = asyncio.create_task(webhook.start_webhook(dispatcher, BotControl.bot))
+    print(
+        f"=== {updates} updates, {MAX_CONNECTIONS} connections,"
+        f" {MAX_IN_FLIGHT} in flight"
+    )
+    try:
+        async with ClientSession() as session:
+            await _wait_serving(session)
+            await _check(session)
+            await _measure(session, updates)
+    finally:
+        serve.cancel()
+        await asyncio.gather(serve, return_exceptions=True)
+        await BotControl.bot.session.close()
+        await dispatcher.fsm.storage.close()
+        await TELEGRAM.stop()
+        await redis.flushdb()
+        await redis.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*map(int, sys.argv[1:])))
@@ -1,6 +1,10 @@
+import asyncio
 import os
+from collections import Counter
 
 from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
@@ -10,10 +14,16 @@ from client.api import Api
 from client.markups import Info, InitializeMarkupInterface
 from client.markups.core import TextMessageMarkup, AsyncInitializeMarkupInterface
 from client.markups.specific import TitleScreen
-from client.utils import Emoji
+from client.utils import Emoji, config
 from client.utils.loggers import errors, info
 from client.utils.redis import Storage
 
+CLEANUP_CONCURRENCY = config.getint("chat", "CLEANUP_CONCURRENCY")
+CLEANUP_IN_BACKGROUND = config.getboolean("chat", "CLEANUP_IN_BACKGROUND")
+MAX_UPDATE_FALLBACKS = config.getint("chat", "MAX_UPDATE_FALLBACKS")
+# Telegram limit of message ids in one deleteMessages
+DELETE_MESSAGES_LIMIT = 100
+
 
 class BotCommands:
     bot_commands = [
@@ -38,8 +48,19 @@ class BotCommands:
 
 
 class BotControl:
-    bot = Bot(os.getenv("TOKEN"), parse_mode="HTML")
+    # TELEGRAM_API points bot to another Bot API server, local or fake one
+    bot = Bot(
+        os.getenv("TOKEN"),
+        AiohttpSession(api=TelegramAPIServer.from_base(os.getenv("TELEGRAM_API")))
+        if os.getenv("TELEGRAM_API")
+        else None,
+        parse_mode="HTML",
+    )
     api = Api
+    # References to running cleanups, so they aren't garbage collected
+    _cleanup_tasks: set[asyncio.Task] = set()
+    # Number of updates by number of fallbacks they needed
+    _update_fallbacks: Counter[int] = Counter()
 
     def __init__(
         self, user_id: int, state: FSMContext | None = None, contextualize: bool = True
@@ -60,12 +81,13 @@ class BotControl:
         # This mechanic open new possibilities. For example.
         # Regardless of a sudden out-of-context message, we can always return to the context node.
         # We can abstract from multitude callbacks.
-        return self.storage.context
+        name, args, kwargs = self.storage.context
+        return InitializeMarkupInterface.initializers[name], args, kwargs
 
     def set_context(
         self, initializer: type[InitializeMarkupInterface], *args, **kwargs
     ):
-        self.storage.context = initializer, args, kwargs
+        self.storage.context = initializer.initializer_name, args, kwargs
 
     async def create_text_message(
         self, text_message_markup: TextMessageMarkup | InitializeMarkupInterface
@@ -112,26 +134,44 @@ class BotControl:
         if self._state is not None:
             await self._state.set_state(text_message_markup.state)
 
-        last_message_id = self.storage.last_message_id
-        if last_message_id is None:
-            await self.create_text_message(text_message_markup)
-            return
+        #  Edit last message, if it can't be edited delete it and try previous one.
+        #  After MAX_UPDATE_FALLBACKS failed messages new message is created,
+        #  so update costs at most 3 * MAX_UPDATE_FALLBACKS + 1 telegram calls.
+        fallbacks = 0
+        while True:
+            last_message_id = self.storage.last_message_id
+            if last_message_id is None or fallbacks == MAX_UPDATE_FALLBACKS:
+                await self.create_text_message(text_message_markup)
+                break
+            try:
+                await self.bot.edit_message_text(
+                    chat_id=self._user_id,
+                    message_id=last_message_id,
+                    text=text_message_markup.text,
+                    reply_markup=text_message_markup.keyboard,
+                )
+                break
+            except TelegramBadRequest as e:
+                if "message is not modified" in e.message:
+                    break
+                fallbacks += 1
+                await self.delete_message(last_message_id)
+                self.storage.pop_last_message_id_from_the_pull()
 
-        try:
-            await self.bot.edit_message_text(
-                chat_id=self._user_id,
-                message_id=last_message_id,
-                text=text_message_markup.text,
-                reply_markup=text_message_markup.keyboard,
-            )
-        except TelegramBadRequest:
-            await self.delete_message(last_message_id)
-            self.storage.pop_last_message_id_from_the_pull()
-            await self.update_text_message(text_message_markup)
+        self._update_fallbacks[fallbacks] += 1
+        if fallbacks:
+            info.info(f"Update for user {self.user_id} needed {fallbacks} fallbacks")
+
+    @classmethod
+    def update_fallbacks_stats(cls):
+        """
+        {fallbacks: updates} since start
+        """
+        return dict(cls._update_fallbacks)
 
     async def return_to_context(self):
         try:
-            initializer, args, kwargs = self.storage.context
+            initializer, args, kwargs = self.context
             if InitializeMarkupInterface in initializer.__bases__:
                 await self.update_text_message(initializer(*args, **kwargs))
             elif AsyncInitializeMarkupInterface in initializer.__bases__:
@@ -162,15 +202,61 @@ class BotControl:
             errors.error(f"Failed sending message to admin: {message}\n{e}")
 
     async def _contextualize_chat(self):
-        valuables_messages = []
-        for message_id in self.storage.message_ids_pull[:-1]:
-            if await self.delete_message(message_id):
-                valuables_messages.append(message_id)
+        """
+        Removes all messages except last from pull at once
+        and returns to it messages which can't be deleted, only edited.
+        In background mode the user gets his update without waiting the cleanup.
+        """
+        message_ids = self.storage.message_ids_pull[:-1]
+        if not message_ids:
+            return
+        self.storage.remove_message_ids_from_the_pull(message_ids)
+        if CLEANUP_IN_BACKGROUND:
+            # Started after flush, otherwise queued LREM could remove ids
+            # which cleanup already returned to the pull
+            self.storage.call_after_flush(
+                lambda: self._start_background_cleanup(message_ids)
+            )
+        else:
+            self.storage.return_message_ids_to_the_pull(
+                await self._cleanup_chat(message_ids)
+            )
+
+    async def _cleanup_chat(self, message_ids: list[int]) -> list[int]:
+        """
+        Deletes messages by batches, messages of failed batches one by one.
+        Returns ids of messages which aren't deleted, but edited
+        """
+        failed = []
+        for start in range(0, len(message_ids), DELETE_MESSAGES_LIMIT):
+            batch = message_ids[start : start + DELETE_MESSAGES_LIMIT]
+            try:
+                await self.bot.delete_messages(self._user_id, batch)
+            except TelegramBadRequest:
+                failed.extend(batch)
+
+        semaphore = asyncio.Semaphore(CLEANUP_CONCURRENCY)
+
+        async def delete_message(message_id: int):
+            async with semaphore:
+                return await self.delete_message(message_id)
+
+        edited = await asyncio.gather(*map(delete_message, failed))
+        return [message_id for message_id, kept in zip(failed, edited) if kept]
+
+    def _start_background_cleanup(self, message_ids: list[int]):
+        task = asyncio.create_task(self._cleanup_chat_in_background(message_ids))
+        self._cleanup_tasks.add(task)
+        task.add_done_callback(self._cleanup_tasks.discard)
+
+    async def _cleanup_chat_in_background(self, message_ids: list[int]):
         try:
-            valuables_messages.append(self.storage.message_ids_pull[-1])
-            self.storage.message_ids_pull = valuables_messages
-        except IndexError:
-            pass
+            edited = await self._cleanup_chat(message_ids)
+            if edited:
+                async with Storage(self._user_id) as storage:
+                    storage.return_message_ids_to_the_pull(edited)
+        except Exception as e:
+            errors.error(f"Failed cleanup chat of user {self.user_id}\n{e}")
 
     async def delete_message(self, message_id: int, forced_text=f"{Emoji.FROG}"):
         try:
@@ -30,12 +30,19 @@ class BuildBotControl(BaseMiddleware):
                 )
             )
             raise e
+        finally:
+            # Everything handler changed in storage is written by one round trip
+            await bot_control.storage.flush()
 
     @classmethod
     async def _build_bot_control(cls, event, state: FSMContext):
         user_id = await cls._extract_user_id(event)
         bot_control = BotControl(user_id, state)
-        bot_control.storage.first_name = await cls._extract_first_name(event)
+        await bot_control.storage.load()
+        first_name = await cls._extract_first_name(event)
+        # Unchanged name isn't written back by flush
+        if bot_control.storage.first_name != first_name:
+            bot_control.storage.first_name = first_name
         return bot_control
 
     @classmethod
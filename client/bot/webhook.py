@@ -0,0 +1,73 @@
+import asyncio
+import os
+import secrets
+from typing import Any, Dict
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from client.utils import config
+from client.utils.loggers import info
+
+WEBHOOK_HOST = config.get("webhook", "HOST")
+WEBHOOK_PORT = config.getint("webhook", "PORT")
+WEBHOOK_PATH = config.get("webhook", "PATH")
+MAX_IN_FLIGHT = config.getint("webhook", "MAX_IN_FLIGHT")
+MAX_CONNECTIONS = config.getint("webhook", "MAX_CONNECTIONS")
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """
+    Updates are handled in background, but no more than max_in_flight at once.
+    When limit is reached, response to Telegram waits for free slot,
+    so Telegram slows down instead of bot piling up tasks.
+    """
+
+    def __init__(
+        self, dispatcher: Dispatcher, bot: Bot, max_in_flight: int, **kwargs: Any
+    ):
+        super().__init__(dispatcher, bot, handle_in_background=True, **kwargs)
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+
+    async def _limited_feed_update(self, bot: Bot, update: Dict[str, Any]):
+        try:
+            await self._background_feed_update(bot, update)
+        finally:
+            self._in_flight.release()
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request):
+        update = await request.json(loads=bot.session.json_loads)
+        await self._in_flight.acquire()
+        task = asyncio.create_task(self._limited_feed_update(bot, update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+
+async def start_webhook(dispatcher: Dispatcher, bot: Bot):
+    """
+    Sets webhook WEBHOOK_URL + WEBHOOK_PATH in Telegram and serves it until cancel.
+    Requests without WEBHOOK_SECRET in X-Telegram-Bot-Api-Secret-Token get 401.
+    """
+    secret_token = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+    app = web.Application()
+    LimitedRequestHandler(
+        dispatcher, bot, MAX_IN_FLIGHT, secret_token=secret_token
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dispatcher, bot=bot)
+
+    await bot.set_webhook(
+        os.getenv("WEBHOOK_URL") + WEBHOOK_PATH,
+        secret_token=secret_token,
+        max_connections=MAX_CONNECTIONS,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+    )
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    info.info(f"Webhook is served on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -1,4 +1,3 @@
-from passlib.hash import pbkdf2_sha256
 from aiogram.types import CallbackQuery
 from aiogram import Router, F
 from aiogram.filters import StateFilter
@@ -15,6 +14,7 @@ from client.markups.specific import (
 )
 from client.utils import Emoji, config
 from client.utils.mailing import Mailing
+from client.utils.scheduler import Scheduler
 
 
 MAX_PASSWORD_LENGTH = config.getint("limitations", "MAX_PASSWORD_LENGTH")
@@ -24,17 +24,16 @@ basic_router = Router()
 
 @basic_router.callback_query(F.data == "invert_notifications")
 async def invert_notifications(callback: CallbackQuery, bot_control: BotControl):
-    _, code = await bot_control.api.invert_notifications(bot_control.user_id)
+    state, code = await bot_control.api.invert_notifications(bot_control.user_id)
     if await bot_control.api_status_code_processing(code, 200):
-        data, code = await bot_control.api.get_user(bot_control.user_id)
-        if await bot_control.api_status_code_processing(code, 200):
-            if data["notifications"]:
-                await callback.answer("Notifications online")
-            else:
-                await callback.answer("Notifications offline")
-            await bot_control.update_text_message(
-                await TitleScreen(bot_control.user_id).init()
-            )
+        await Scheduler.update_notifications(bot_control.user_id, state)
+        if state["notifications"]:
+            await callback.answer("Notifications online")
+        else:
+            await callback.answer("Notifications offline")
+        await bot_control.update_text_message(
+            await TitleScreen(bot_control.user_id).init()
+        )
 
 
 @basic_router.callback_query(F.data == "authorization")
@@ -92,6 +91,7 @@ async def reset_password(callback: CallbackQuery, bot_control: BotControl):
         email = data["email"]
         await bot_control.update_text_message(Temp())
         verify_code = await Mailing.send_verify_code(
+            bot_control.storage,
             email,
             "Reset password",
             bot_control.storage.first_name,
@@ -105,7 +105,6 @@ async def reset_password(callback: CallbackQuery, bot_control: BotControl):
             return
 
         bot_control.storage.email = email
-        bot_control.storage.verify_code = verify_code
         await bot_control.update_text_message(
             Input(
                 f"Verify code sent on your email {Emoji.INCOMING_ENVELOPE}",
@@ -124,8 +123,11 @@ async def verify_code_to_reset_password_accept_input(
     verify_code = bot_control.storage.verify_code
     if verify_code is None:
         await bot_control.update_text_message(Temp())
-        bot_control.storage.verify_code = await Mailing.send_verify_code(
-            bot_control.storage.email, "Reset password", bot_control.storage.first_name
+        await Mailing.send_verify_code(
+            bot_control.storage,
+            bot_control.storage.email,
+            "Reset password",
+            bot_control.storage.first_name,
         )
         await bot_control.update_text_message(
             Input(
@@ -200,16 +202,30 @@ async def repeat_password_accept_input(message: Message, bot_control: BotControl
         )
         return
 
-    bot_control.storage.hash = pbkdf2_sha256.hash(repeat_password)
-    await bot_control.update_text_message(PasswordResume(repeat_password))
+    # Bot can decrypt it, so it isn't kept longer than PASSWORD_EXPIRATION
+    bot_control.storage.encrypted_password = bot_control.api.encrypt(repeat_password)
+    await bot_control.update_text_message(
+        await PasswordResume(repeat_password).init()
+    )
 
 
 @basic_router.callback_query(F.data == "update_password")
 async def update_password(callback: CallbackQuery, bot_control: BotControl):
+    encrypted_password = bot_control.storage.encrypted_password
+    if encrypted_password is None:
+        await bot_control.update_text_message(
+            Input(
+                f"Time for confirm password expired {Emoji.HOURGLASS_END} Try again {Emoji.KEY}",
+                state=States.input_text_password,
+            )
+        )
+        return
+
     _, code = await bot_control.api.update_password(
-        bot_control.user_id, bot_control.storage.hash
+        bot_control.user_id, encrypted_password
     )
     if await bot_control.api_status_code_processing(code, 200):
+        bot_control.storage.encrypted_password = None
         bot_control.set_context(TitleScreen, bot_control.user_id)
         await bot_control.update_text_message(
             Info(f"Password updated {Emoji.KEY + Emoji.OK}")
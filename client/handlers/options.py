@@ -78,13 +78,13 @@ async def email_accept_input(message: Message, bot_control: BotControl):
 
     await bot_control.update_text_message(Temp())
     verify_code = await Mailing.send_verify_code(
-        email, "Verify email", bot_control.storage.first_name
+        bot_control.storage, email, "Verify email", bot_control.storage.first_name
     )
 
     if verify_code is None:
         await bot_control.update_text_message(
             Input(
-                f"Email not found {Emoji.CRYING_CAT} Try again {Emoji.EMAIL}",
+                f"Failed to send email {Emoji.CRYING_CAT} Try again {Emoji.EMAIL}",
                 state=States.input_text_email,
             )
         )
@@ -96,7 +96,6 @@ async def email_accept_input(message: Message, bot_control: BotControl):
             state=States.input_text_verify_email_code,
         )
     )
-    bot_control.storage.verify_code = verify_code
     bot_control.storage.email = email
 
 
@@ -108,8 +107,11 @@ async def email_accept_input(message: Message, bot_control: BotControl):
     verify_code = bot_control.storage.verify_code
     if verify_code is None:
         await bot_control.update_text_message(Temp())
-        bot_control.storage.verify_code = await Mailing.send_verify_code(
-            bot_control.storage.email, "Verify email", bot_control.storage.first_name
+        await Mailing.send_verify_code(
+            bot_control.storage,
+            bot_control.storage.email,
+            "Verify email",
+            bot_control.storage.first_name,
         )
         await bot_control.update_text_message(
             Input(
@@ -168,11 +170,11 @@ async def notifications_minute_accept_callback_data(
     callback_data: NotificationsMinuteCallbackData,
     bot_control: BotControl,
 ):
-    _, code = await bot_control.api.update_notifications_time(
+    state, code = await bot_control.api.update_notifications_time(
         bot_control.storage.user_token,
         bot_control.storage.hour,
         callback_data.minute,
     )
     if await bot_control.api_status_code_processing(code, 200):
-        await Scheduler.refresh_notifications(bot_control.user_id)
+        await Scheduler.update_notifications(bot_control.user_id, state)
         await bot_control.return_to_context()
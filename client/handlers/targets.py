@@ -59,10 +59,12 @@ async def current_targets_left(
     bot_control: BotControl,
 ):
     bot_control.set_context(
-        TargetsList, bot_control.storage.user_token, callback_data.page
+        TargetsList, bot_control.storage.user_token, before_id=callback_data.before_id
     )
     await bot_control.update_text_message(
-        await TargetsList(bot_control.storage.user_token, callback_data.page).init()
+        await TargetsList(
+            bot_control.storage.user_token, before_id=callback_data.before_id
+        ).init()
     )
 
 
@@ -73,10 +75,12 @@ async def current_targets_right(
     bot_control: BotControl,
 ):
     bot_control.set_context(
-        TargetsList, bot_control.storage.user_token, callback_data.page
+        TargetsList, bot_control.storage.user_token, after_id=callback_data.after_id
     )
     await bot_control.update_text_message(
-        await TargetsList(bot_control.storage.user_token, callback_data.page).init()
+        await TargetsList(
+            bot_control.storage.user_token, after_id=callback_data.after_id
+        ).init()
     )
 
 
@@ -122,9 +126,9 @@ async def current_target(callback: CallbackQuery, bot_control: BotControl):
 async def invert_completed(callback: CallbackQuery, bot_control: BotControl):
     target_id = bot_control.storage.target_id
     token = bot_control.storage.user_token
-    _, code = await bot_control.api.invert_completed(token, target_id)
+    state, code = await bot_control.api.invert_completed(token, target_id)
     if await bot_control.api_status_code_processing(code, 200):
-        await Scheduler.refresh_notifications(bot_control.user_id)
+        await Scheduler.update_notifications(bot_control.user_id, state)
         await bot_control.update_text_message(await Target(token, target_id).init())
 
 
@@ -229,7 +233,6 @@ async def delete_target(callback: CallbackQuery, bot_control: BotControl):
             no_callback_data="completed_target",
         )
     )
-    await Scheduler.refresh_notifications(bot_control.user_id)
 
 
 @targets_router.callback_query(F.data == "delete_target")
@@ -241,15 +244,15 @@ async def delete_target(callback: CallbackQuery, bot_control: BotControl):
             no_callback_data="current_target",
         )
     )
-    await Scheduler.refresh_notifications(bot_control.user_id)
 
 
 @targets_router.callback_query(F.data == "conform_delete_target")
 async def conform_delete_target(callback: CallbackQuery, bot_control: BotControl):
-    _, code = await bot_control.api.delete_target(
+    state, code = await bot_control.api.delete_target(
         bot_control.storage.user_token, bot_control.storage.target_id
     )
     if await bot_control.api_status_code_processing(code, 200):
+        await Scheduler.update_notifications(bot_control.user_id, state)
         await bot_control.update_text_message(
             Info(f"Target deleted {Emoji.FALLEN_LEAF}")
         )
@@ -348,27 +351,27 @@ async def input_text_target_border(message: Message, bot_control: BotControl):
         )
         return
 
-    _, code = await bot_control.api.create_target(
+    state, code = await bot_control.api.create_target(
         bot_control.storage.user_token,
         bot_control.storage.target_name,
         border,
         bot_control.storage.target_description,
     )
     if await bot_control.api_status_code_processing(code, 201):
-        await Scheduler.refresh_notifications(bot_control.user_id)
+        await Scheduler.update_notifications(bot_control.user_id, state)
         await bot_control.update_text_message(Info(f"Target created {Emoji.SPROUT}"))
 
 
 @targets_router.callback_query(F.data == "conform_create_target")
 async def conform_create_target(callback: CallbackQuery, bot_control: BotControl):
-    _, code = await bot_control.api.create_target(
+    state, code = await bot_control.api.create_target(
         bot_control.storage.user_token,
         bot_control.storage.target_name,
         STANDARD_BORDER_RANGE,
         bot_control.storage.target_description,
     )
     if await bot_control.api_status_code_processing(code, 201):
-        await Scheduler.refresh_notifications(bot_control.user_id)
+        await Scheduler.update_notifications(bot_control.user_id, state)
         await bot_control.update_text_message(Info(f"Target created {Emoji.OK}"))
 
 
@@ -1,15 +1,34 @@
 import asyncio
+import os
 
+from client.api import Api
 from client.bot.dispatcher import dispatcher
 from client.bot import BotControl, BotCommands
+from client.bot.webhook import start_webhook
+from client.utils.mailing import Mailing
+from client.utils.passwords import Passwords
 from client.utils.scheduler import Scheduler
 
 
 async def main():
-    Scheduler.scheduler.start()
-    Scheduler.set_job_increase_progress()
+    # Every replica handles updates (in webhook mode), only leader runs jobs
+    scheduler = asyncio.create_task(Scheduler.lead())
+    mailing = asyncio.create_task(Mailing.serve())
     await BotControl.bot.set_my_commands(BotCommands.bot_commands)
-    await dispatcher.start_polling(BotControl.bot)
+    await Passwords.start()
+    try:
+        # BOT_MODE: polling (default) or webhook
+        if os.getenv("BOT_MODE", "polling") == "webhook":
+            await start_webhook(dispatcher, BotControl.bot)
+        else:
+            await BotControl.bot.delete_webhook()
+            await dispatcher.start_polling(BotControl.bot)
+    finally:
+        scheduler.cancel()
+        mailing.cancel()
+        await asyncio.gather(scheduler, mailing, return_exceptions=True)
+        await Api.close()
+        Passwords.shutdown()
 
 
 if __name__ == "__main__":
@@ -14,6 +14,20 @@ from client.utils import Emoji
 
 
 class InitializeMarkupInterface(ABC):
+    # Contexts keep initializer by registered name, so it survives class moving.
+    # Renamed class should be registered with old name: class New(..., name="Old")
+    initializers: dict[str, type["InitializeMarkupInterface"]] = {}
+    initializer_name: str
+
+    def __init_subclass__(cls, name: str | None = None, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.initializer_name = name or cls.__name__
+        registered = InitializeMarkupInterface.initializers.setdefault(
+            cls.initializer_name, cls
+        )
+        if registered is not cls:
+            raise ValueError(f"Initializer {cls.initializer_name} already registered")
+
     def __init__(self, state: State | None = None):
         self.text_message_markup = TextMessageMarkup(state)
 
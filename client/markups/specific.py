@@ -2,7 +2,6 @@ import time
 from datetime import datetime
 
 from aiogram.filters.callback_data import CallbackData
-from zxcvbn import zxcvbn
 
 from client.bot.FSM import States
 from client.markups import (
@@ -20,6 +19,7 @@ from client.markups.core import (
     AsyncInitializeMarkupInterface,
 )
 from client.utils import Emoji, create_progress_text, config
+from client.utils.passwords import Passwords
 
 
 class TitleScreen(AsyncInitializeMarkupInterface):
@@ -83,7 +83,7 @@ class AuthenticationWithPassword(AsyncInitializeMarkupInterface):
         return self
 
 
-class PasswordResume(InitializeMarkupInterface):
+class PasswordResume(AsyncInitializeMarkupInterface):
     _strength_marks = {
         4: f"{Emoji.GREEN_CIRCLE} Reliable",
         3: f"{Emoji.YELLOW_CIRCLE} Good",
@@ -102,19 +102,27 @@ class PasswordResume(InitializeMarkupInterface):
         no_callback_data: str | CallbackData = "input_password",
     ):
         super().__init__()
+        self._password = password
+        self.yes_text = yes_text
+        self.no_text = no_text
+        self.yes_callback_data = yes_callback_data
+        self.no_callback_data = no_callback_data
+
+    async def init(self):
         conform = Conform(
-            text=self._password_resume(password),
-            yes_text=yes_text,
-            no_text=no_text,
-            yes_callback_data=yes_callback_data,
-            no_callback_data=no_callback_data,
+            text=await self._password_resume(self._password),
+            yes_text=self.yes_text,
+            no_text=self.no_text,
+            yes_callback_data=self.yes_callback_data,
+            no_callback_data=self.no_callback_data,
         )
 
         self.text_message_markup.attach(conform)
+        return self
 
     @classmethod
-    def _password_resume(cls, password: str):
-        grade = zxcvbn(password)
+    async def _password_resume(cls, password: str):
+        grade = await Passwords.grade(password)
         grade_text = f"{Emoji.DIAGRAM} Password grade\n"
         grade_text += (
             f"{Emoji.SHIELD} Strength: " + cls._strength_marks[grade["score"]] + "\n"
@@ -314,11 +322,11 @@ class ChangeNotificationsMinute(InitializeMarkupInterface):
 
 
 class TargetsLeftCallbackData(CallbackData, prefix="left_current_targets_list"):
-    page: int
+    before_id: int
 
 
 class TargetsRightCallbackData(CallbackData, prefix="right_current_targets_list"):
-    page: int
+    after_id: int
 
 
 class TargetCallbackData(CallbackData, prefix="current_target"):
@@ -327,21 +335,39 @@ class TargetCallbackData(CallbackData, prefix="current_target"):
 
 class TargetsList(AsyncInitializeMarkupInterface):
     _targets_per_page = 5
+    # Page before maximum target id is the last page
+    _last_page_before_id = 2**31 - 1
 
     def __init__(
         self,
         token: str,
-        page: int = 0,
+        after_id: int = 0,
+        before_id: int | None = None,
         back_callback_data: str | CallbackData = "profile",
     ):
         super().__init__()
-        self._page = page
+        self._after_id = after_id
+        self._before_id = before_id
         self._token = token
         self.back_callback_data = back_callback_data
 
     async def init(self):
-        targets, code = await self._api.get_targets(self._token)
+        if self._before_id is not None:
+            data, code = await self._api.get_targets(
+                self._token, before_id=self._before_id, limit=self._targets_per_page
+            )
+        else:
+            data, code = await self._api.get_targets(
+                self._token, after_id=self._after_id, limit=self._targets_per_page
+            )
+        if code == 200 and not data["targets"] and data["total"]:
+            # Page became empty (e.g. targets deleted), so show first page
+            data, code = await self._api.get_targets(
+                self._token, limit=self._targets_per_page
+            )
+
         if code == 200:
+            targets = data["targets"]
             if not targets:
                 self.text_message_markup.attach(
                     Info(
@@ -350,24 +376,15 @@ class TargetsList(AsyncInitializeMarkupInterface):
                     )
                 )
             else:
-                completed_targets_all_time = sum(
-                    (
-                        1
-                        for target in targets
-                        if target["progress"] == target["border_progress"]
-                    )
-                )
                 progress = TextWidget(
                     text=create_progress_text(
-                        completed_targets_all_time,
-                        len(targets),
+                        data["achieved"],
+                        data["total"],
                         progress_element=Emoji.DECIDUOUS_TREE,
                         remaining_element=Emoji.SPROUT,
                     )
                 )
-                count = 0
-                pages = []
-                page = []
+                self.text_message_markup.add_text_row(progress)
                 for target in targets:
                     button = ButtonWidget(text=target["name"])
                     if target["progress"] == target["border_progress"]:
@@ -379,29 +396,21 @@ class TargetsList(AsyncInitializeMarkupInterface):
                         if target["completed"]:
                             button.mark = Emoji.DROPLET
                         button.callback_data = TargetCallbackData(id=target["id"])
-
-                    if count == self._targets_per_page:
-                        count = 0
-                        pages.append(page)
-                        page = []
-                    page.append(button)
-                    count += 1
-                pages.append(page)
-
-                self.text_message_markup.add_text_row(progress)
-                for button in pages[self._page]:
                     self.text_message_markup.add_button_in_new_row(button)
 
-                total_pages = len(pages)
-
-                if len(targets) > self._targets_per_page:
+                if data["has_before"] or data["has_after"]:
+                    # Pages are cycled: left from first page leads to the last one
                     self.text_message_markup.attach(
                         LeftBackRight(
                             left_callback_data=TargetsLeftCallbackData(
-                                page=(self._page - 1) % total_pages
+                                before_id=(
+                                    targets[0]["id"]
+                                    if data["has_before"]
+                                    else self._last_page_before_id
+                                )
                             ),
                             right_callback_data=TargetsRightCallbackData(
-                                page=(self._page + 1) % total_pages
+                                after_id=targets[-1]["id"] if data["has_after"] else 0
                             ),
                             back_callback_data=self.back_callback_data,
                         )
@@ -1,20 +1,102 @@
+import asyncio
 import os
 import secrets
+import time
 from string import digits
 from email.mime.text import MIMEText
+from typing import Awaitable, Callable, Dict
 
 import aiosmtplib
-from aiosmtplib import SMTPException
+from aiosmtplib import SMTPException, SMTPServerDisconnected
+from redis.exceptions import RedisError
 
-from client.utils import config
+from client.bot import BotControl
+from client.markups import Info
+from client.utils import config, Emoji
+from client.utils.loggers import info, errors
+from client.utils.redis import Storage, VERIFY_CODE_EXPIRATION
 
 MAIL_ADDRESS = os.getenv("ORGANIZATION_EMAIL")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
-PORT = config.getint("mailing", "PORT")
-SMTP_SERVER = config.get("mailing", "SMTP_SERVER")
+# SMTP_SERVER, SMTP_PORT and SMTP_TLS point mailing to another server, local one
+SMTP_SERVER = os.getenv("SMTP_SERVER") or config.get("mailing", "SMTP_SERVER")
+PORT = int(os.getenv("SMTP_PORT") or config.getint("mailing", "PORT"))
+USE_TLS = (os.getenv("SMTP_TLS") or config.get("mailing", "USE_TLS")) == "true"
+TIMEOUT = config.getint("mailing", "TIMEOUT")
+POOL_SIZE = config.getint("mailing", "POOL_SIZE")
+WORKERS = config.getint("mailing", "WORKERS")
+RETRIES = config.getint("mailing", "RETRIES")
+RETRY_DELAY = config.getint("mailing", "RETRY_DELAY")
+
+
+class SMTPPool:
+    """
+    Up to POOL_SIZE logged in connections, idle ones are kept open for next messages.
+    Connection closed by server meanwhile is reconnected once before send fails.
+    """
+
+    _idle: list[aiosmtplib.SMTP] = []
+    _slots = asyncio.Semaphore(POOL_SIZE)
+
+    @classmethod
+    async def _connect(cls):
+        connection = aiosmtplib.SMTP(
+            hostname=SMTP_SERVER,
+            port=PORT,
+            username=MAIL_ADDRESS if SMTP_PASSWORD else None,
+            password=SMTP_PASSWORD,
+            use_tls=USE_TLS,
+            timeout=TIMEOUT,
+        )
+        await connection.connect()
+        return connection
+
+    @staticmethod
+    def _close(connection: aiosmtplib.SMTP | None):
+        if connection is not None and connection.is_connected:
+            connection.close()
+
+    @classmethod
+    async def send(cls, receiver: str, message: str):
+        async with cls._slots:
+            connection = cls._idle.pop() if cls._idle else None
+            try:
+                try:
+                    if connection is None or not connection.is_connected:
+                        connection = await cls._connect()
+                    await connection.sendmail(MAIL_ADDRESS, receiver, message)
+                except SMTPServerDisconnected:
+                    connection = await cls._connect()
+                    await connection.sendmail(MAIL_ADDRESS, receiver, message)
+            except BaseException:
+                cls._close(connection)
+                raise
+            cls._idle.append(connection)
+
+    @classmethod
+    async def close(cls):
+        while cls._idle:
+            connection = cls._idle.pop()
+            try:
+                await connection.quit()
+            except (SMTPException, OSError):
+                cls._close(connection)
 
 
 class Mailing:
+    """
+    Mails are queued in redis list "mail:queue" and sent by WORKERS workers
+    of every replica through SMTPPool. Handler gets verify code right after
+    enqueue, user is told by bot if mail is not delivered.
+    Mail taken by replica which died before sending is lost,
+    user gets new code when asks again.
+    """
+
+    _redis = Storage.storage
+    _queue_key = "mail:queue"
+    _sent = 0
+    _failed = 0
+
     @classmethod
     async def _generate_secret_key(cls):
         return "".join((secrets.choice(digits) for _ in range(6)))
@@ -22,29 +104,121 @@ class Mailing:
     @classmethod
     async def send_verify_code(
         cls,
+        storage: Storage,
         receiver: str,
         subject: str = "Verify",
         name: str = "",
     ):
+        """
+        Returns verify code or None if mail is not queued.
+        Code is written to storage before mail is queued, so notify of failed mail
+        always finds it
+        """
+        user_id = storage.user_id
         verify_code = await cls._generate_secret_key()
+        storage.verify_code = verify_code
+        await storage.flush()
+        mail = {
+            "user_id": int(user_id),
+            "receiver": receiver,
+            "subject": subject,
+            "name": name,
+            "verify_code": verify_code,
+            "queued_at": time.time(),
+        }
+        try:
+            await cls._redis.rpush(cls._queue_key, cls._redis.dumps(mail))
+        except RedisError as e:
+            errors.error(f"Mail to user {user_id} not queued\n{e}")
+            storage.verify_code = None
+            return
+        return verify_code
+
+    @staticmethod
+    def _message(mail: Dict):
         message = "Psychological service.\n"
-        if name:
-            message += f"Hello, {name}\n"
-        message += f"Your verify code: {verify_code}"
+        if mail["name"]:
+            message += f"Hello, {mail['name']}\n"
+        message += f"Your verify code: {mail['verify_code']}"
         message = MIMEText(message)
-        message["To"] = receiver
+        message["To"] = mail["receiver"]
         message["From"] = MAIL_ADDRESS
-        message["Subject"] = subject
-        async with aiosmtplib.SMTP(
-            hostname=SMTP_SERVER,
-            username=MAIL_ADDRESS,
-            port=PORT,
-            password=SMTP_PASSWORD,
-            use_tls=True,
-        ) as connect:
+        message["Subject"] = mail["subject"]
+        return message.as_string()
+
+    @classmethod
+    async def _deliver(cls, mail: Dict):
+        """
+        Returns True if sent, False if server refused mail or retries are over
+        """
+        for attempt in range(RETRIES + 1):
             try:
-                await connect.sendmail(MAIL_ADDRESS, receiver, message.as_string())
-            except SMTPException:
+                await SMTPPool.send(mail["receiver"], cls._message(mail))
+                return True
+            except (SMTPServerDisconnected, OSError, asyncio.TimeoutError) as e:
+                errors.warning(f"Failed sending mail to user {mail['user_id']}: {e}")
+                await asyncio.sleep(RETRY_DELAY * 2**attempt)
+            except SMTPException as e:
+                errors.error(f"Mail to user {mail['user_id']} refused\n{e}")
+                return False
+        errors.error(f"Mail to user {mail['user_id']} not sent, retries are over")
+        return False
+
+    @staticmethod
+    async def notify(mail: Dict, delivered: bool):
+        """
+        Tells user that mail is not delivered, if he still waits for this code
+        """
+        if delivered:
+            return
+        bot_control = BotControl(mail["user_id"])
+        async with bot_control.storage:
+            if bot_control.storage.verify_code != mail["verify_code"]:
                 return
+            bot_control.storage.verify_code = None
+            await bot_control.create_text_message(
+                Info(
+                    f"Failed to send email on {mail['receiver']}"
+                    f" {Emoji.CRYING_CAT} Sorry"
+                )
+            )
 
-            return verify_code
+    @classmethod
+    async def _work(cls, notify: Callable[[Dict, bool], Awaitable]):
+        while True:
+            try:
+                _, data = await cls._redis.blpop([cls._queue_key])
+            except RedisError as e:
+                errors.error(f"Failed taking mail from queue\n{e}")
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+            mail = cls._redis.loads(data)
+            if time.time() - mail["queued_at"] > VERIFY_CODE_EXPIRATION:
+                info.info(f"Mail to user {mail['user_id']} expired in queue")
+                continue
+            try:
+                delivered = await cls._deliver(mail)
+                await notify(mail, delivered)
+            except Exception as e:
+                errors.error(f"Failed delivery of mail to user {mail['user_id']}\n{e}")
+                continue
+            if delivered:
+                cls._sent += 1
+            else:
+                cls._failed += 1
+
+    @classmethod
+    async def serve(cls, notify: Callable[[Dict, bool], Awaitable] | None = None):
+        """
+        Sends queued mails until cancel, notify gets every mail and if it delivered
+        """
+        try:
+            await asyncio.gather(
+                *(cls._work(notify or cls.notify) for _ in range(WORKERS))
+            )
+        finally:
+            await SMTPPool.close()
+
+    @classmethod
+    def stats(cls):
+        return {"sent": cls._sent, "failed": cls._failed}
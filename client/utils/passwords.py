@@ -0,0 +1,83 @@
+import asyncio
+import hashlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple
+
+from zxcvbn import zxcvbn
+
+from client.utils import config
+
+WORKERS = config.getint("passwords", "WORKERS")
+MAX_PENDING = config.getint("passwords", "MAX_PENDING")
+GRADE_CACHE_TTL = config.getint("passwords", "GRADE_CACHE_TTL")
+
+
+def _load_dictionaries():
+    # zxcvbn ranks its dictionaries on import, first grade warms up the rest
+    zxcvbn("load")
+
+
+def _grade(password: str):
+    grade = zxcvbn(password)
+    # Matches of full result are heavy to send back from process
+    return {"score": grade["score"], "feedback": grade["feedback"]}
+
+
+class Passwords:
+    """
+    zxcvbn is slow, so grades are computed in pool of WORKERS processes
+    instead of event loop and kept GRADE_CACHE_TTL seconds.
+    No more than MAX_PENDING calls wait for pool, others wait for free slot here.
+    Passwords are hashed and verified only by backend.
+    """
+
+    _pool: ProcessPoolExecutor | None = None
+    _pending = asyncio.Semaphore(MAX_PENDING)
+    # sha256 of password -> (grade, monotonic expiration time)
+    _grades: Dict[str, Tuple[Dict, float]] = {}
+
+    @classmethod
+    def _executor(cls):
+        if cls._pool is None:
+            cls._pool = ProcessPoolExecutor(
+                max_workers=WORKERS, initializer=_load_dictionaries
+            )
+        return cls._pool
+
+    @classmethod
+    async def _run(cls, function, *args):
+        async with cls._pending:
+            return await asyncio.get_running_loop().run_in_executor(
+                cls._executor(), function, *args
+            )
+
+    @classmethod
+    async def grade(cls, password: str):
+        """
+        Returns zxcvbn score and feedback of password
+        """
+        key = hashlib.sha256(password.encode()).hexdigest()
+        cached = cls._grades.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+
+        grade = await cls._run(_grade, password)
+        now = time.monotonic()
+        for expired in [k for k, (_, expires) in cls._grades.items() if expires <= now]:
+            del cls._grades[expired]
+        cls._grades[key] = (grade, now + GRADE_CACHE_TTL)
+        return grade
+
+    @classmethod
+    async def start(cls):
+        """
+        Starts processes of pool with loaded dictionaries before first user
+        """
+        await asyncio.gather(*(cls._run(_load_dictionaries) for _ in range(WORKERS)))
+
+    @classmethod
+    def shutdown(cls):
+        if cls._pool is not None:
+            cls._pool.shutdown(cancel_futures=True)
+            cls._pool = None
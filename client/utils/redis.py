@@ -1,8 +1,10 @@
 import os
 import pickle
-from typing import Union, Any
+import time
+from typing import Union, Any, Callable
 
-from redis import Redis
+import msgpack
+from redis.asyncio import Redis, ConnectionPool
 from redis.commands.core import ResponseT
 from redis.typing import KeyT, ExpiryT, AbsExpiryT
 
@@ -11,6 +13,9 @@ from client.utils import config
 VERIFY_CODE_EXPIRATION = config.getint("limitations", "VERIFY_CODE_EXPIRATION")
 PASSWORD_EXPIRATION = config.getint("limitations", "PASSWORD_EXPIRATION")
 EMAIL_EXPIRATION = config.getint("limitations", "EMAIL_EXPIRATION")
+MAX_CONNECTIONS = config.getint("redis", "MAX_CONNECTIONS")
+SERIALIZER = config.get("redis", "SERIALIZER")
+MAX_MESSAGE_IDS_PULL = config.getint("limitations", "MAX_MESSAGE_IDS_PULL")
 
 
 # Plan B for serialize/deserialize:
@@ -24,8 +29,43 @@ EMAIL_EXPIRATION = config.getint("limitations", "EMAIL_EXPIRATION")
 #     return pickle.loads(b64decode(sequence.encode()))
 
 
+class PickleSerializer:
+    dumps = staticmethod(pickle.dumps)
+    loads = staticmethod(pickle.loads)
+
+
+class MsgpackSerializer:
+    """
+    Only plain data: None, bool, int, float, str, bytes, list, dict.
+    Tuples are loaded as lists.
+    Values pickled before serializer was changed are still loaded.
+    """
+
+    @staticmethod
+    def dumps(value: Any) -> bytes:
+        return msgpack.packb(value)
+
+    @staticmethod
+    def loads(data: bytes) -> Any:
+        # Pickle starts with PROTO opcode 0x80, for msgpack it is whole empty dict
+        if len(data) > 1 and data[0] == 0x80:
+            return pickle.loads(data)
+        return msgpack.unpackb(data)
+
+
+serializers = {"pickle": PickleSerializer, "msgpack": MsgpackSerializer}
+
+
 class CustomRedis(Redis):
-    def set(
+    serializer = serializers[SERIALIZER]
+
+    def dumps(self, value: Any) -> bytes:
+        return self.serializer.dumps(value)
+
+    def loads(self, data: bytes) -> Any:
+        return self.serializer.loads(data)
+
+    async def set(
         self,
         name: KeyT,
         value: Any,
@@ -38,9 +78,9 @@ class CustomRedis(Redis):
         exat: Union[AbsExpiryT, None] = None,
         pxat: Union[AbsExpiryT, None] = None,
     ) -> ResponseT:
-        return super().set(
+        return await super().set(
             name,
-            pickle.dumps(value),
+            self.dumps(value),
             ex,
             px,
             nx,
@@ -51,19 +91,19 @@ class CustomRedis(Redis):
             pxat,
         )
 
-    def get(self, name: KeyT) -> ResponseT:
-        result = super().get(name)
+    async def get(self, name: KeyT) -> ResponseT:
+        result = await super().get(name)
         if result is not None:
-            return pickle.loads(result)
+            return self.loads(result)
 
-    def setex(self, name: KeyT, time: ExpiryT, value: Any) -> ResponseT:
-        return super().setex(
+    async def setex(self, name: KeyT, time: ExpiryT, value: Any) -> ResponseT:
+        return await super().setex(
             name,
             time,
-            pickle.dumps(value),
+            self.dumps(value),
         )
 
-    def getex(
+    async def getex(
         self,
         name: KeyT,
         ex: Union[ExpiryT, None] = None,
@@ -72,134 +112,287 @@ class CustomRedis(Redis):
         pxat: Union[AbsExpiryT, None] = None,
         persist: bool = False,
     ) -> ResponseT:
-        result = super().getex(name, ex, px, exat, pxat, persist)
+        result = await super().getex(name, ex, px, exat, pxat, persist)
         if result is not None:
-            return pickle.loads(result)
+            return self.loads(result)
 
 
 class Storage:
+    """
+    User session in one redis hash "session:{user_id}", field per property.
+    Whole hash is read by one HGETALL in load() and changed fields are written
+    by one pipeline in flush(), properties between them work without network.
+    Hash fields can't expire, so expiring fields keep "{field}:expires_at" near.
+    Message ids pull is native list "message_ids:{user_id}" capped by
+    MAX_MESSAGE_IDS_PULL, its changes are sent as RPUSH/LREM, not whole list.
+
+    async with Storage(user_id) as storage:
+        storage.target_id = 1
+    """
+
     storage = CustomRedis(
-        host=os.getenv("REDIS_HOST"), port=int(os.getenv("REDIS_PORT")), db=1
+        connection_pool=ConnectionPool(
+            host=os.getenv("REDIS_HOST"),
+            port=int(os.getenv("REDIS_PORT")),
+            db=1,
+            max_connections=MAX_CONNECTIONS,
+        )
     )
+    # field -> key prefix in old layout of key per field, see storage_migration
+    _keys = {
+        "context": "context",
+        "first_name": "first_name",
+        "user_token": "token",
+        "hour": "hour",
+        "message_ids_pull": "message_ids_pull",
+        "verify_code": "verify_code",
+        "email": "email",
+        "password": "password",
+        "encrypted_password": "encrypted_password",
+        "target_id": "target_id",
+        "target_name": "target_name",
+        "target_description": "target_description",
+    }
+    _expirations = {
+        "verify_code": VERIFY_CODE_EXPIRATION,
+        "password": PASSWORD_EXPIRATION,
+        "encrypted_password": PASSWORD_EXPIRATION,
+    }
 
     def __init__(self, user_id):
         self.user_id = user_id
+        self._values: dict[str, Any] | None = None
+        self._changed: set[str] = set()
+        self._message_ids_operations: list[tuple] = []
+        self._after_flush: list[Callable[[], Any]] = []
+
+    async def __aenter__(self):
+        return await self.load()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.flush()
+
+    @property
+    def _key(self):
+        return f"session:{self.user_id}"
+
+    @property
+    def _message_ids_key(self):
+        return f"message_ids:{self.user_id}"
+
+    @staticmethod
+    def _expires_at_field(field: str):
+        return f"{field}:expires_at"
+
+    async def load(self):
+        pipeline = self.storage.pipeline(transaction=False)
+        pipeline.hgetall(self._key)
+        pipeline.lrange(self._message_ids_key, 0, -1)
+        session, message_ids = await pipeline.execute()
+        session = {
+            field.decode(): self.storage.loads(value)
+            for field, value in session.items()
+        }
+        self._values = {field: session.get(field) for field in self._keys}
+        self._values["message_ids_pull"] = [int(id_) for id_ in message_ids]
+        self._changed.clear()
+        self._message_ids_operations.clear()
+        self._after_flush.clear()
+        now = time.time()
+        for field in self._expirations:
+            expires_at = session.get(self._expires_at_field(field))
+            if expires_at is not None and expires_at <= now:
+                # Expired field is removed from hash by next flush
+                self._values[field] = None
+                self._changed.add(field)
+        return self
+
+    def call_after_flush(self, callback: Callable[[], Any]):
+        """
+        callback is called once, after changes made before it are written
+        """
+        self._after_flush.append(callback)
+
+    async def flush(self):
+        if self._changed or self._message_ids_operations:
+            await self._write()
+        callbacks, self._after_flush = self._after_flush, []
+        for callback in callbacks:
+            callback()
+
+    async def _write(self):
+        mapping, deleted = {}, []
+        for field in self._changed:
+            value = self._values[field]
+            if value is None:
+                deleted.append(field)
+                if field in self._expirations:
+                    deleted.append(self._expires_at_field(field))
+                continue
+            mapping[field] = self.storage.dumps(value)
+            if field in self._expirations:
+                mapping[self._expires_at_field(field)] = self.storage.dumps(
+                    time.time() + self._expirations[field]
+                )
+        self._changed.clear()
+        # MULTI, so list is trimmed in the same step it grows
+        pipeline = self.storage.pipeline(transaction=True)
+        if mapping:
+            pipeline.hset(self._key, mapping=mapping)
+        if deleted:
+            pipeline.hdel(self._key, *deleted)
+        for command, *args in self._message_ids_operations:
+            getattr(pipeline, command)(self._message_ids_key, *args)
+        if self._message_ids_operations:
+            pipeline.ltrim(self._message_ids_key, -MAX_MESSAGE_IDS_PULL, -1)
+        self._message_ids_operations.clear()
+        await pipeline.execute()
+
+    def _get(self, field: str):
+        if self._values is None:
+            raise RuntimeError(f"Storage of user {self.user_id} is not loaded")
+        return self._values[field]
+
+    def _set(self, field: str, data: Any):
+        if self._values is None:
+            raise RuntimeError(f"Storage of user {self.user_id} is not loaded")
+        self._values[field] = data
+        self._changed.add(field)
 
     @property
     def context(self):
-        return self.storage.get(f"context:{self.user_id}")
+        return self._get("context")
 
     @context.setter
     def context(self, data: Any):
-        self.storage.set(f"context:{self.user_id}", data)
+        self._set("context", data)
 
     @property
     def first_name(self):
-        return self.storage.get(f"first_name:{self.user_id}")
+        return self._get("first_name")
 
     @first_name.setter
     def first_name(self, data: Any):
-        self.storage.set(f"first_name:{self.user_id}", data)
+        self._set("first_name", data)
 
     @property
     def user_token(self):
-        return self.storage.get(f"token:{self.user_id}")
+        return self._get("user_token")
 
     @user_token.setter
     def user_token(self, data: Any):
-        self.storage.set(f"token:{self.user_id}", data)
+        self._set("user_token", data)
 
     @property
     def hour(self):
-        return self.storage.get(f"hour:{self.user_id}")
+        return self._get("hour")
 
     @hour.setter
     def hour(self, data: Any):
-        self.storage.set(f"hour:{self.user_id}", data)
+        self._set("hour", data)
 
     @property
     def message_ids_pull(self):
-        pull = self.storage.get(f"message_ids_pull:{self.user_id}")
-        if pull is None:
-            return []
-        return pull
+        return list(self._get("message_ids_pull"))
 
     @property
     def last_message_id(self):
         try:
-            return self.message_ids_pull[-1]
+            return self._get("message_ids_pull")[-1]
         except IndexError:
             pass
 
     def add_message_id_to_the_pull(self, message_id: int):
-        pull = self.message_ids_pull
+        pull = self._get("message_ids_pull")
         pull.append(message_id)
-        self.message_ids_pull = pull
+        del pull[:-MAX_MESSAGE_IDS_PULL]
+        self._message_ids_operations.append(("rpush", message_id))
 
     def pop_last_message_id_from_the_pull(self):
-        pull = self.message_ids_pull
+        pull = self._get("message_ids_pull")
         try:
-            pull.pop()
-            self.message_ids_pull = pull
+            message_id = pull.pop()
         except IndexError:
-            pass
+            return
+        # Removed by value from tail, concurrent handler could push after it
+        self._message_ids_operations.append(("lrem", -1, message_id))
+
+    def remove_message_ids_from_the_pull(self, message_ids: list[int]):
+        pull = self._get("message_ids_pull")
+        removed = set(message_ids)
+        pull[:] = [message_id for message_id in pull if message_id not in removed]
+        for message_id in removed:
+            self._message_ids_operations.append(("lrem", 0, message_id))
+
+    def return_message_ids_to_the_pull(self, message_ids: list[int]):
+        """
+        Puts older message ids back to the head of pull
+        """
+        if not message_ids:
+            return
+        self._get("message_ids_pull")[:0] = message_ids
+        self._message_ids_operations.append(("lpush", *reversed(message_ids)))
 
     @message_ids_pull.setter
-    def message_ids_pull(self, data: Any):
-        self.storage.set(f"message_ids_pull:{self.user_id}", data)
+    def message_ids_pull(self, data: list[int]):
+        pull = self._get("message_ids_pull")
+        pull[:] = data[-MAX_MESSAGE_IDS_PULL:]
+        self._message_ids_operations.append(("delete",))
+        if pull:
+            self._message_ids_operations.append(("rpush", *pull))
 
     @property
     def verify_code(self):
-        return self.storage.getex(f"verify_code:{self.user_id}")
+        return self._get("verify_code")
 
     @verify_code.setter
     def verify_code(self, data: Any):
-        self.storage.setex(f"verify_code:{self.user_id}", VERIFY_CODE_EXPIRATION, data)
+        self._set("verify_code", data)
 
     @property
     def email(self):
-        return self.storage.get(f"email:{self.user_id}")
+        return self._get("email")
 
     @email.setter
     def email(self, data: Any):
-        self.storage.set(f"email:{self.user_id}", data)
+        self._set("email", data)
 
     @property
     def password(self):
-        return self.storage.getex(f"password:{self.user_id}")
+        return self._get("password")
 
     @password.setter
     def password(self, data: Any):
-        self.storage.setex(f"password:{self.user_id}", PASSWORD_EXPIRATION, data)
+        self._set("password", data)
 
     @property
-    def hash(self):
-        return self.storage.get(f"hash:{self.user_id}")
+    def encrypted_password(self):
+        return self._get("encrypted_password")
 
-    @hash.setter
-    def hash(self, data: Any):
-        self.storage.set(f"hash:{self.user_id}", data)
+    @encrypted_password.setter
+    def encrypted_password(self, data: Any):
+        self._set("encrypted_password", data)
 
     @property
     def target_id(self):
-        return self.storage.get(f"target_id:{self.user_id}")
+        return self._get("target_id")
 
     @target_id.setter
     def target_id(self, data: Any):
-        self.storage.set(f"target_id:{self.user_id}", data)
+        self._set("target_id", data)
 
     @property
     def target_name(self):
-        return self.storage.get(f"target_name:{self.user_id}")
+        return self._get("target_name")
 
     @target_name.setter
     def target_name(self, data: Any):
-        self.storage.set(f"target_name:{self.user_id}", data)
+        self._set("target_name", data)
 
     @property
     def target_description(self):
-        return self.storage.get(f"target_description:{self.user_id}")
+        return self._get("target_description")
 
     @target_description.setter
     def target_description(self, data: Any):
-        self.storage.set(f"target_description:{self.user_id}", data)
+        self._set("target_description", data)
@@ -1,9 +1,20 @@
+import asyncio
 import os
+import time
+from datetime import datetime
+from typing import Awaitable, Callable
 
-from apscheduler.jobstores.base import JobLookupError
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+)
+from aiohttp import ClientError
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.jobstores.redis import RedisJobStore
-from apscheduler.triggers.cron import CronTrigger
+from redis import asyncio as aioredis
+from redis.exceptions import LockError, RedisError
 
 from client.api import Api
 from client.bot import BotControl
@@ -11,10 +22,270 @@ from client.markups import Info
 from client.utils import config, Emoji
 
 from client.utils.loggers import info, errors
-from client.utils.redis import Storage, CustomRedis
+from client.utils.redis import Storage
 
 MINUTE_INCREASE_PROGRESS = config.getint("limitations", "MINUTE_INCREASE_PROGRESS")
 HOUR_INCREASE_PROGRESS = config.getint("limitations", "HOUR_INCREASE_PROGRESS")
+REMINDERS_CONCURRENCY = config.getint("reminders", "CONCURRENCY")
+REMINDERS_RATE = config.getfloat("reminders", "RATE")
+REMINDERS_BURST = config.getint("reminders", "BURST")
+REMINDERS_RETRIES = config.getint("reminders", "RETRIES")
+REMINDERS_RETRY_DELAY = config.getfloat("reminders", "RETRY_DELAY")
+LEADER_TTL = config.getfloat("scheduler", "LEADER_TTL")
+
+
+class ReminderBuckets:
+    """
+    Users with on notifications grouped by notification time:
+    set "reminders:HH:MM" of user ids per minute of day
+    and hash "reminders:users" user id -> his bucket, to move user between buckets.
+    """
+
+    # Plain client on pool of Storage, ids must not go through CustomRedis serializer
+    _redis = aioredis.Redis(connection_pool=Storage.storage.connection_pool)
+    _users_key = "reminders:users"
+    # Move is one step in redis, so concurrent puts of user (handler and refresh,
+    # two replicas) can't leave him in bucket which "reminders:users" doesn't know
+    _put_script = _redis.register_script(
+        """
+        local old = redis.call("HGET", KEYS[1], ARGV[1])
+        if old == ARGV[2] then
+            return 0
+        end
+        if old then
+            redis.call("SREM", ARGV[3] .. old, ARGV[1])
+        end
+        if ARGV[2] == "" then
+            redis.call("HDEL", KEYS[1], ARGV[1])
+        else
+            redis.call("SADD", ARGV[3] .. ARGV[2], ARGV[1])
+            redis.call("HSET", KEYS[1], ARGV[1], ARGV[2])
+        end
+        return 1
+        """
+    )
+
+    @staticmethod
+    def bucket(hour: int, minute: int):
+        return f"{hour:02}:{minute:02}"
+
+    @classmethod
+    def _bucket_key(cls, bucket: str):
+        return f"reminders:{bucket}"
+
+    @classmethod
+    async def put(cls, user_id: str, bucket: str | None):
+        """
+        bucket None removes user from reminders
+        """
+        await cls._put_script(
+            keys=[cls._users_key],
+            args=[user_id, bucket or "", cls._bucket_key("")],
+        )
+
+    @classmethod
+    async def users(cls, bucket: str):
+        return await cls._redis.smembers(cls._bucket_key(bucket))
+
+
+class TokenBucket:
+    """
+    Allows rate sends per second on average and burst sends at once.
+    pause() stops all senders, Telegram answers RetryAfter for whole bot.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(
+                    self._burst, self._tokens + (now - self._updated) * self._rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+
+class Broadcast:
+    """
+    Reminders delivery.
+    User ids are queued in redis list "reminders:outbox", while sending id is kept
+    in "reminders:outbox:processing", so ids left after crash are sent on next drain.
+    One drain at time, new ids pushed while draining are picked up by it.
+    """
+
+    _redis = ReminderBuckets._redis
+    _outbox_key = "reminders:outbox"
+    _processing_key = "reminders:outbox:processing"
+    _limiter = TokenBucket(REMINDERS_RATE, REMINDERS_BURST)
+    _task: asyncio.Task | None = None
+
+    @classmethod
+    async def enqueue(cls, user_ids):
+        if user_ids:
+            await cls._redis.rpush(cls._outbox_key, *user_ids)
+
+    @classmethod
+    def start(cls, send: Callable[[int], Awaitable]):
+        """
+        Starts drain in background if it isn't running yet
+        """
+        if cls._task is None or cls._task.done():
+            cls._task = asyncio.create_task(cls.drain(send))
+        return cls._task
+
+    @classmethod
+    async def stop(cls):
+        """
+        Stops drain, ids being sent stay in processing list for next leader
+        """
+        if cls._task is not None and not cls._task.done():
+            cls._task.cancel()
+            await asyncio.gather(cls._task, return_exceptions=True)
+
+    @classmethod
+    async def _recover(cls):
+        while await cls._redis.lmove(
+            cls._processing_key, cls._outbox_key, "RIGHT", "LEFT"
+        ):
+            pass
+
+    @classmethod
+    async def _deliver(cls, send: Callable[[int], Awaitable], user_id: int):
+        """
+        Returns True if sent, False if user can't get messages or retries are over
+        """
+        for attempt in range(REMINDERS_RETRIES + 1):
+            await cls._limiter.acquire()
+            try:
+                await send(user_id)
+                return True
+            except TelegramRetryAfter as e:
+                errors.warning(f"Flood control, sending paused for {e.retry_after}s")
+                cls._limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                info.info(f"User {user_id} blocked bot, remaining skipped")
+                return False
+            except (TelegramNetworkError, ClientError, asyncio.TimeoutError) as e:
+                errors.warning(f"Failed sending remaining to user {user_id}: {e}")
+                await asyncio.sleep(REMINDERS_RETRY_DELAY * 2**attempt)
+            except TelegramAPIError as e:
+                errors.error(f"Failed sending remaining to user {user_id}\n{e}")
+                return False
+        errors.error(f"Remaining to user {user_id} not sent, retries are over")
+        return False
+
+    @classmethod
+    async def drain(cls, send: Callable[[int], Awaitable]):
+        """
+        Sends to every user id in outbox, returns (sent, failed)
+        """
+        await cls._recover()
+        sent = failed = 0
+        start = time.monotonic()
+
+        async def worker():
+            nonlocal sent, failed
+            while user_id := await cls._redis.lmove(
+                cls._outbox_key, cls._processing_key, "LEFT", "RIGHT"
+            ):
+                try:
+                    delivered = await cls._deliver(send, int(user_id))
+                except Exception as e:
+                    errors.error(f"Failed sending remaining to user {user_id}\n{e}")
+                    delivered = False
+                await cls._redis.lrem(cls._processing_key, 1, user_id)
+                if delivered:
+                    sent += 1
+                else:
+                    failed += 1
+
+        await asyncio.gather(*(worker() for _ in range(REMINDERS_CONCURRENCY)))
+        elapsed = time.monotonic() - start
+        if sent or failed:
+            info.info(
+                f"Reminders broadcast: sent {sent}, failed {failed}"
+                f" in {elapsed:.1f}s ({sent / max(elapsed, 0.001):.1f} msg/s)"
+            )
+        return sent, failed
+
+
+class Leadership:
+    """
+    Only one of bot replicas runs scheduler jobs.
+    Replicas compete for redis lock "scheduler:leader" with LEADER_TTL,
+    leader extends it every LEADER_TTL / 3. If leader dies, lock expires
+    and another replica takes leadership in at most LEADER_TTL.
+    """
+
+    # Plain client, lock token must not go through CustomRedis serializer
+    _redis = aioredis.Redis(connection_pool=Storage.storage.connection_pool)
+    _lock = _redis.lock("scheduler:leader", timeout=LEADER_TTL)
+    is_leader = False
+
+    @classmethod
+    async def run(
+        cls, on_elected: Callable[[], Awaitable], on_lost: Callable[[], Awaitable]
+    ):
+        while True:
+            try:
+                if cls.is_leader:
+                    await cls._lock.reacquire()
+                elif await cls._lock.acquire(blocking=False):
+                    cls.is_leader = True
+                    info.info("Replica became scheduler leader")
+                    await cls._elect(on_elected, on_lost)
+            except (LockError, RedisError) as e:
+                # Can't prove leadership, other replica may take it
+                if cls.is_leader:
+                    cls.is_leader = False
+                    errors.error(f"Replica lost scheduler leadership: {e}")
+                    await on_lost()
+            await asyncio.sleep(LEADER_TTL / 3)
+
+    @classmethod
+    async def _elect(
+        cls, on_elected: Callable[[], Awaitable], on_lost: Callable[[], Awaitable]
+    ):
+        """
+        If jobs can't be started, leadership is given up and taken again later,
+        otherwise every replica would stay paused
+        """
+        try:
+            await on_elected()
+        except Exception as e:
+            errors.error(f"Failed starting scheduler jobs, leadership released: {e}")
+            await on_lost()
+            await cls.release()
+
+    @classmethod
+    async def release(cls):
+        """
+        Lets other replica take leadership without waiting LEADER_TTL
+        """
+        if cls.is_leader:
+            cls.is_leader = False
+            try:
+                await cls._lock.release()
+            except (LockError, RedisError) as e:
+                errors.error(f"Failed release scheduler leadership: {e}")
 
 
 class Scheduler:
@@ -24,7 +295,54 @@ class Scheduler:
     scheduler.configure(jobstores=_jobstores, job_defaults=_job_defaults)
 
     _increase_progress_id = "increase_progress"
+    _dispatch_reminders_id = "dispatch_reminders"
     _api = Api
+    _seeding: asyncio.Task | None = None
+
+    @classmethod
+    async def lead(cls):
+        """
+        Scheduler is started paused in every replica and runs jobs
+        only while the replica is leader, see Leadership
+        """
+        cls.scheduler.start(paused=True)
+        try:
+            await Leadership.run(cls._on_elected, cls._on_lost)
+        finally:
+            await Leadership.release()
+            cls.scheduler.shutdown(wait=False)
+
+    @classmethod
+    async def _on_elected(cls):
+        cls.set_job_increase_progress()
+        cls.set_job_dispatch_reminders()
+        cls.scheduler.resume()
+        # Not awaited, long stream must not delay extending of leader lock
+        cls._seeding = asyncio.create_task(cls._seed_reminders())
+
+    @classmethod
+    async def _on_lost(cls):
+        cls.scheduler.pause()
+        if cls._seeding is not None:
+            cls._seeding.cancel()
+        await Broadcast.stop()
+
+    @classmethod
+    async def _seed_reminders(cls):
+        """
+        Reminder buckets are filled from server before per-user jobs
+        of previous versions are removed, so their users keep getting reminders
+        """
+        while not await cls.refresh_all_notifications():
+            await asyncio.sleep(LEADER_TTL)
+        info.info("Refreshed notifications for all users")
+        cls._remove_legacy_jobs()
+
+    @classmethod
+    def _remove_legacy_jobs(cls):
+        for job in cls.scheduler.get_jobs():
+            if job.id not in (cls._increase_progress_id, cls._dispatch_reminders_id):
+                job.remove()
 
     @classmethod
     def set_job_increase_progress(
@@ -40,38 +358,57 @@ class Scheduler:
         )
 
     @classmethod
-    async def refresh_notifications(cls, user_id: str):
+    def set_job_dispatch_reminders(cls):
+        """
+        One wakeup per minute instead of one job per user.
+        Per-user jobs left from previous versions are removed by _seed_reminders.
+        """
+        cls.scheduler.add_job(
+            Workers.dispatch_reminders,
+            "cron",
+            id=cls._dispatch_reminders_id,
+            replace_existing=True,
+            minute="*",
+            misfire_grace_time=30,
+        )
+
+    @classmethod
+    async def update_notifications(cls, user_id: str, state: dict):
         """
         Notifications will be on in case:
         1) User have any not marked target
         2) User have on notifications
+        State is returned by server with every change of targets or notifications
         """
-        user, user_code = await cls._api.get_user(user_id)
-        targets, targets_code = await cls._api.get_targets(Storage(user_id).user_token)
-        if user_code == 200 and targets_code == 200:
-            all_done = True
-            for target in targets:
-                if not target["completed"]:
-                    all_done = False
-                    break
-            if user["notifications"] and not all_done:
-                time_ = user["notification_time"]
-                cls.scheduler.add_job(
-                    func=Workers.remainder,
-                    trigger=CronTrigger(hour=time_["hour"], minute=time_["minute"]),
-                    args=(int(user_id),),
-                    replace_existing=True,
-                    id=user_id,
-                )
-                info.info(f"Notifications on for user {user_id}")
-            else:
-                try:
-                    cls.scheduler.remove_job(job_id=user_id, jobstore="default")
-                    info.info(f"Notifications off for user {user_id}")
-                except JobLookupError:
-                    pass
+        await cls._set_notifications(
+            user_id,
+            state["notifications"] and state["unfinished_targets"] > 0,
+            state["notification_time"],
+        )
+
+    @classmethod
+    async def refresh_all_notifications(cls):
+        """
+        Same as update_notifications for every user, states by one streamed request
+        """
+        try:
+            async for state in cls._api.get_notifications_states():
+                await cls.update_notifications(state["id"], state)
+        except ClientError as e:
+            errors.critical(f"Failed refresh notifications for all users: {e}")
+            return False
+        return True
+
+    @classmethod
+    async def _set_notifications(cls, user_id: str, on: bool, time_: dict):
+        if on:
+            await ReminderBuckets.put(
+                user_id, ReminderBuckets.bucket(time_["hour"], time_["minute"])
+            )
+            info.info(f"Notifications on for user {user_id}")
         else:
-            errors.critical(f"Failed refresh notification for user: {user_id}")
+            await ReminderBuckets.put(user_id, None)
+            info.info(f"Notifications off for user {user_id}")
 
 
 class Workers:
@@ -79,30 +416,37 @@ class Workers:
 
     @staticmethod
     async def remainder(user_id: int):
-        await BotControl(user_id).create_text_message(
-            Info(f"Don`t forget mark done targets today {Emoji.SPROUT}")
-        )
+        bot_control = BotControl(user_id)
+        async with bot_control.storage:
+            await bot_control.create_text_message(
+                Info(f"Don`t forget mark done targets today {Emoji.SPROUT}")
+            )
         info.info(f"Remaining sent to user {user_id}")
 
+    @classmethod
+    async def dispatch_reminders(cls):
+        now = datetime.now()
+        bucket = ReminderBuckets.bucket(now.hour, now.minute)
+        await Broadcast.enqueue(list(await ReminderBuckets.users(bucket)))
+        # Not awaited, so slow broadcast doesn't make next minute job to be skipped
+        Broadcast.start(cls.remainder)
+
     @classmethod
     async def increase_progress(cls):
-        _, code = await cls._api.increase_progress()
-
-        if code == 200:
-            info.info(f"Progress increased")
-            users, code = await cls._api.get_users()
-            if code == 200:
-                for user in users:
-                    await Scheduler.refresh_notifications(user["id"])
-                info.info("Refreshed notifications for all users")
-            errors.critical("Refreshed notifications for all users failed")
-        else:
-            errors.critical(f"Progress not increased. Status: {code}")
-            storage = CustomRedis(
-                host=os.getenv("REDIS_HOST"), port=int(os.getenv("REDIS_PORT")), db=1
-            )
-            count = storage.get(f"not_increase_count")
+        """
+        Only users with reopened targets can get reminders back,
+        their states come with rollover, other users aren't reread
+        """
+        try:
+            async for state in cls._api.increase_progress():
+                await Scheduler.update_notifications(state["id"], state)
+        except (ClientError, asyncio.TimeoutError) as e:
+            errors.critical(f"Progress not increased\n{e}")
+            storage = Storage.storage
+            count = await storage.get(f"not_increase_count")
             if count is None:
                 count = 0
             count += 1
-            storage.set(f"not_increase_count", count)
+            await storage.set(f"not_increase_count", count)
+        else:
+            info.info("Progress increased")
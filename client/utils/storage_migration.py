@@ -0,0 +1,103 @@
+"""
+Moves sessions from old layout of key per field ("token:{user_id}", ...)
+to hash per user "session:{user_id}" and message ids pulls to lists
+"message_ids:{user_id}", also pulls kept in session hash field.
+Safe to run again, old keys are deleted only after their values are written.
+
+python -m client.utils.storage_migration
+"""
+
+import asyncio
+import time
+from collections import defaultdict
+
+from client.utils.redis import Storage, MAX_MESSAGE_IDS_PULL
+
+SCAN_COUNT = 1000
+
+
+async def _old_keys():
+    """
+    Returns {user_id: {field: key}} of every old key
+    """
+    users = defaultdict(dict)
+    for field, prefix in Storage._keys.items():
+        async for key in Storage.storage.scan_iter(f"{prefix}:*", count=SCAN_COUNT):
+            user_id = key.decode().removeprefix(f"{prefix}:")
+            users[user_id][field] = key
+    return users
+
+
+async def _migrate_user(user_id: str, keys: dict):
+    storage = Storage(user_id)
+    fields = list(keys)
+    pipeline = Storage.storage.pipeline(transaction=False)
+    for field in fields:
+        pipeline.get(keys[field])
+        pipeline.pttl(keys[field])
+    pipeline.exists(storage._message_ids_key)
+    *results, message_ids_exist = await pipeline.execute()
+
+    mapping, message_ids = {}, []
+    now = time.time()
+    for field, value, pttl in zip(fields, results[::2], results[1::2]):
+        if value is None:
+            continue
+        if field == "message_ids_pull":
+            # List already written by new layout is newer than old key
+            if not message_ids_exist:
+                message_ids = Storage.storage.loads(value)[-MAX_MESSAGE_IDS_PULL:]
+            continue
+        mapping[field] = value
+        if field in Storage._expirations and pttl > 0:
+            mapping[storage._expires_at_field(field)] = Storage.storage.dumps(
+                now + pttl / 1000
+            )
+
+    pipeline = Storage.storage.pipeline(transaction=True)
+    if mapping:
+        # Fields already written by new layout are newer than old keys
+        for field, value in mapping.items():
+            pipeline.hsetnx(storage._key, field, value)
+    if message_ids:
+        pipeline.rpush(storage._message_ids_key, *message_ids)
+    pipeline.delete(*keys.values())
+    await pipeline.execute()
+    return len(mapping) + bool(message_ids)
+
+
+async def _migrate_message_ids_fields():
+    """
+    Moves pulls from "message_ids_pull" field of session hashes to lists
+    """
+    migrated = 0
+    async for key in Storage.storage.scan_iter("session:*", count=SCAN_COUNT):
+        storage = Storage(key.decode().removeprefix("session:"))
+        pipeline = Storage.storage.pipeline(transaction=False)
+        pipeline.hget(storage._key, "message_ids_pull")
+        pipeline.exists(storage._message_ids_key)
+        value, message_ids_exist = await pipeline.execute()
+        if value is None:
+            continue
+        pipeline = Storage.storage.pipeline(transaction=True)
+        message_ids = Storage.storage.loads(value)[-MAX_MESSAGE_IDS_PULL:]
+        if message_ids and not message_ids_exist:
+            pipeline.rpush(storage._message_ids_key, *message_ids)
+        pipeline.hdel(storage._key, "message_ids_pull")
+        await pipeline.execute()
+        migrated += 1
+    return migrated
+
+
+async def main():
+    users = await _old_keys()
+    fields = 0
+    for user_id, keys in users.items():
+        fields += await _migrate_user(user_id, keys)
+    print(f"Migrated {len(users)} users, {fields} fields")
+    print(f"Moved {await _migrate_message_ids_fields()} pulls from session hashes")
+    await Storage.storage.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
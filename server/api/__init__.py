@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 from fastapi import Request, FastAPI, HTTPException, Depends
 
 from server.api.authority import Authority
@@ -6,9 +8,18 @@ from server.api.targets import targets_router
 from server.api.users import users_router
 
 from server.utils.loggers import errors
+from server.utils.passwords import Passwords
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    Passwords.shutdown()
 
 
-app = FastAPI(dependencies=[Depends(Authority.authenticate_service)])
+app = FastAPI(
+    dependencies=[Depends(Authority.authenticate_service)], lifespan=lifespan
+)
 app.include_router(users_router)
 app.include_router(targets_router)
 
@@ -1,30 +1,93 @@
+import hmac
 import os
+import time
 from datetime import datetime, timedelta
-from typing import Dict, Annotated
+from typing import Dict, Annotated, Tuple
 
 import jwt
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives.twofactor import InvalidToken
 from fastapi import HTTPException, Depends, Header
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from passlib.handlers.pbkdf2 import pbkdf2_sha256
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
 from server.api.models import AuthApiModel, Token
-from server.database import Session
-from server.database.queries import UserQueries, ServiceQueries
+from server.database import get_session
+from server.database.queries import (
+    UserQueries,
+    ServiceQueries,
+    PasswordQueries,
+    RevocationQueries,
+)
 from server.utils import config
+from server.utils.passwords import Passwords
 
 oauth2_schema = OAuth2PasswordBearer(tokenUrl="users/login")
 
 ACCESS_TOKEN_EXPIRE_MINUTES = config.getint(
     "limitations", "ACCESS_TOKEN_EXPIRE_MINUTES"
 )
+SERVICE_CACHE_TTL_SECONDS = config.getint("cache", "SERVICE_CACHE_TTL_SECONDS")
+STATELESS_USER_AUTHORIZATION = config.getboolean(
+    "authorization", "STATELESS_USER_AUTHORIZATION"
+)
+DENYLIST_REFRESH_SECONDS = config.getint("authorization", "DENYLIST_REFRESH_SECONDS")
+
+
+class TokenDenylist:
+    """
+    In stateless mode a valid token is trusted without user lookup.
+    Tokens of user issued before his revocation time are rejected.
+    Must be updated every time user deleted or his credentials changed.
+    Revocations are kept in database, so all workers and replicas share them.
+    Worker rereads them once in DENYLIST_REFRESH_SECONDS, so token revoked by
+    other worker is accepted here no longer than that.
+    Revocations older than token lifetime are deleted, their tokens are expired.
+    """
+
+    _lifetime_seconds = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    # user id -> unix time of revocation
+    _revoked: Dict[str, float] = {}
+    # monotonic time of next reread
+    _refresh_at = 0.0
+
+    @classmethod
+    async def revoke(cls, session: AsyncSession, user_id: str):
+        revoked_at = time.time()
+        await RevocationQueries.revoke(
+            session, user_id, revoked_at, revoked_at - cls._lifetime_seconds
+        )
+        cls._revoked[user_id] = revoked_at
+
+    @classmethod
+    async def _refresh(cls, session: AsyncSession):
+        if time.monotonic() < cls._refresh_at:
+            return
+        # Concurrent requests don't reread while this one waits for database
+        cls._refresh_at = time.monotonic() + DENYLIST_REFRESH_SECONDS
+        try:
+            cls._revoked = await RevocationQueries.get_revocations(
+                session, time.time() - cls._lifetime_seconds
+            )
+        except BaseException:
+            cls._refresh_at = 0.0
+            raise
+
+    @classmethod
+    async def is_revoked(cls, session: AsyncSession, payload: Dict):
+        await cls._refresh(session)
+        revoked_at = cls._revoked.get(payload.get("sub"))
+        return revoked_at is not None and payload.get("iat", 0) <= revoked_at
 
 
 class Authority:
     _jwt_algorithm = "HS256"
     _cipher = Fernet(os.getenv("CIPHER"))
+    # service id -> (api key, monotonic expiration time)
+    _services_cache: Dict[str, Tuple[str, float]] = {}
+    _services_cache_hits = 0
+    _services_cache_misses = 0
 
     @classmethod
     async def decrypt_message(cls, data: bytes | str):
@@ -51,47 +114,104 @@ class Authority:
             )
 
     @classmethod
-    async def _verify_password(cls, password: str, hash_):
-        return pbkdf2_sha256.verify(password, hash_)
+    async def _verify_password(
+        cls, session: AsyncSession, user_id: str, password: str, hash_
+    ):
+        verified, new_hash = await Passwords.verify_and_update(password, hash_)
+        if new_hash is not None:
+            # Cost changed in config, hash is upgraded while password is known
+            await PasswordQueries.rehash_password(session, user_id, hash_, new_hash)
+        return verified
 
     @classmethod
-    async def user_authenticate(cls, auth_api_model: AuthApiModel):
-        async with Session.begin() as session:
-            user = await UserQueries.get_user(session, auth_api_model.user_id)
-            if user is None or (
-                user.get("hash") is not None
-                and not await cls._verify_password(
-                    auth_api_model.password, user.get("hash")
-                )
-            ):
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Incorrect user id or api key",
-                    headers={"WWW-Authenticate": "Bearer"},
-                )
+    async def user_authenticate(
+        cls,
+        auth_api_model: AuthApiModel,
+        session: Annotated[AsyncSession, Depends(get_session)],
+    ):
+        user = await UserQueries.get_user(session, auth_api_model.user_id)
+        # Connection goes back to pool while password is verified
+        await session.commit()
+        if user is None or (
+            user.get("hash") is not None
+            and not await cls._verify_password(
+                session,
+                auth_api_model.user_id,
+                auth_api_model.password,
+                user.get("hash"),
+            )
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Incorrect user id or api key",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
         expire = datetime.now() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         return Token(
             access_token=cls._encode_jwt(
-                {"sub": auth_api_model.user_id, "exp": expire}
+                {"sub": auth_api_model.user_id, "exp": expire, "iat": time.time()}
             ),
             token_type="bearer",
         )
 
     @classmethod
-    async def user_authorization(cls, token: Annotated[str, Depends(oauth2_schema)]):
+    async def user_authorization(
+        cls,
+        token: Annotated[str, Depends(oauth2_schema)],
+        session: Annotated[AsyncSession, Depends(get_session)],
+    ):
         payload = await cls._decode_jwt(token)
-        async with Session.begin() as session:
+        if await TokenDenylist.is_revoked(session, payload):
+            raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Token revoked")
+        if not STATELESS_USER_AUTHORIZATION:
             if await UserQueries.get_user(session, payload.get("sub")) is None:
                 raise HTTPException(status.HTTP_401_UNAUTHORIZED, "Incorrect sub field")
         return payload
 
+    @classmethod
+    async def _get_service_api_key(cls, session: AsyncSession, service_id: str):
+        cached = cls._services_cache.get(service_id)
+        if cached is not None and cached[1] > time.monotonic():
+            cls._services_cache_hits += 1
+            return cached[0]
+
+        cls._services_cache_misses += 1
+        service = await ServiceQueries.get_service(session, service_id)
+        if service is None:
+            cls._services_cache.pop(service_id, None)
+            return
+        cls._services_cache[service_id] = (
+            service.api_key,
+            time.monotonic() + SERVICE_CACHE_TTL_SECONDS,
+        )
+        return service.api_key
+
+    @classmethod
+    def invalidate_service_cache(cls, service_id: str | None = None):
+        if service_id is None:
+            cls._services_cache.clear()
+        else:
+            cls._services_cache.pop(service_id, None)
+
+    @classmethod
+    def service_cache_stats(cls):
+        return {
+            "hits": cls._services_cache_hits,
+            "misses": cls._services_cache_misses,
+            "size": len(cls._services_cache),
+        }
+
     @classmethod
     async def authenticate_service(
-        cls, x_service_name: Annotated[str, Header()], api_key: Annotated[str, Header()]
+        cls,
+        x_service_name: Annotated[str, Header()],
+        api_key: Annotated[str, Header()],
+        session: Annotated[AsyncSession, Depends(get_session)],
     ):
-        async with Session.begin() as session:
-            service = await ServiceQueries.get_service(session, x_service_name)
-        if service is None or service.api_key != api_key:
+        expected_api_key = await cls._get_service_api_key(session, x_service_name)
+        if expected_api_key is None or not hmac.compare_digest(
+            expected_api_key.encode(), api_key.encode()
+        ):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect service name or api key",
@@ -100,7 +100,8 @@ class AuthApiModel(BaseModel):
 
 class UpdatePasswordApiModel(BaseModel):
     user_id: str
-    hash: str
+    # Encrypted by CIPHER, hashed here
+    password: str
 
     @async_field_validator("user_id")
     async def user_id_validate(self, value: str):
@@ -1,8 +1,11 @@
+import json
 from typing import Annotated
 
-from fastapi import Depends, APIRouter
+from fastapi import Depends, APIRouter, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import StreamingResponse
 
-from server.database import Session
+from server.database import get_session
 from server.api.models import TargetApiModel, UpdateTargetApiModel, Payload
 from server.database.queries import TargetsQueries
 from server.utils import config
@@ -10,69 +13,89 @@ from server.api import Authority
 
 MAX_NAME_LENGTH = config.getint("limitations", "MAX_NAME_LENGTH")
 MAX_DESCRIPTION_LENGTH = config.getint("limitations", "MAX_DESCRIPTION_LENGTH")
+MAX_TARGETS_PAGE_LIMIT = config.getint("limitations", "MAX_TARGETS_PAGE_LIMIT")
 
 targets_router = APIRouter(prefix="/targets")
 
 
 @targets_router.get("/")
 async def get_targets(
-    payload: Annotated[Payload, Depends(Authority.user_authorization)]
+    payload: Annotated[Payload, Depends(Authority.user_authorization)],
+    session: Annotated[AsyncSession, Depends(get_session)],
+    after_id: int | None = None,
+    before_id: int | None = None,
+    limit: Annotated[int | None, Query(ge=1, le=MAX_TARGETS_PAGE_LIMIT)] = None,
 ):
-    async with Session.begin() as session:
+    """
+    Without limit returns all user targets.
+    With limit returns one page of targets after_id or before_id with totals.
+    """
+    if limit is None:
         return await TargetsQueries.get_targets(session, payload["sub"])
+    return await TargetsQueries.get_targets_page(
+        session, payload["sub"], limit, after_id, before_id
+    )
 
 
 @targets_router.get(
     "/{target_id}", dependencies=[Depends(Authority.user_authorization)]
 )
-async def get_target(target_id: int):
-    async with Session.begin() as session:
-        return await TargetsQueries.get_target(session, target_id)
+async def get_target(
+    target_id: int, session: Annotated[AsyncSession, Depends(get_session)]
+):
+    return await TargetsQueries.get_target(session, target_id)
 
 
 @targets_router.post("/", status_code=201)
 async def create_target(
     target_api_model: TargetApiModel,
     payload: Annotated[Payload, Depends(Authority.user_authorization)],
+    session: Annotated[AsyncSession, Depends(get_session)],
 ):
-    async with Session.begin() as session:
-        await TargetsQueries.create(
-            session, payload["sub"], **target_api_model.model_dump()
-        )
+    return await TargetsQueries.create(
+        session, payload["sub"], **target_api_model.model_dump()
+    )
 
 
-@targets_router.put(
-    "/{target_id}", dependencies=[Depends(Authority.user_authorization)]
-)
+@targets_router.put("/{target_id}")
 async def update_target_name(
     target_id: int,
     update_target_api_model: UpdateTargetApiModel,
+    payload: Annotated[Payload, Depends(Authority.user_authorization)],
+    session: Annotated[AsyncSession, Depends(get_session)],
 ):
-    async with Session.begin() as session:
-        await TargetsQueries.get_target(session, target_id)
-        await TargetsQueries.update(
-            session, target_id, **update_target_api_model.model_dump()
-        )
+    await TargetsQueries.update(
+        session, payload["sub"], target_id, **update_target_api_model.model_dump()
+    )
 
 
-@targets_router.delete(
-    "/{target_id}", dependencies=[Depends(Authority.user_authorization)]
-)
-async def delete_target(target_id: int):
-    async with Session.begin() as session:
-        await TargetsQueries.get_target(session, target_id)
-        await TargetsQueries.delete(session, target_id)
+@targets_router.delete("/{target_id}")
+async def delete_target(
+    target_id: int,
+    payload: Annotated[Payload, Depends(Authority.user_authorization)],
+    session: Annotated[AsyncSession, Depends(get_session)],
+):
+    return await TargetsQueries.delete(session, payload["sub"], target_id)
 
 
-@targets_router.patch(
-    "/{target_id}/invert", dependencies=[Depends(Authority.user_authorization)]
-)
-async def invert_target_completed(target_id: int):
-    async with Session.begin() as session:
-        await TargetsQueries.get_target(session, target_id)
-        return await TargetsQueries.invert_completed(session, target_id)
+@targets_router.patch("/{target_id}/invert")
+async def invert_target_completed(
+    target_id: int,
+    payload: Annotated[Payload, Depends(Authority.user_authorization)],
+    session: Annotated[AsyncSession, Depends(get_session)],
+):
+    return await TargetsQueries.invert_completed(session, payload["sub"], target_id)
 
 
 @targets_router.patch("/progress")
 async def increase_targets_progress():
-    await TargetsQueries.increase_progress()
+    """
+    NDJSON notifications states of users whose targets were reopened,
+    sent while rollover goes through targets
+    """
+
+    async def lines():
+        async for state in TargetsQueries.increase_progress():
+            yield json.dumps(state) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -1,10 +1,12 @@
+import json
 from typing import Annotated
 from datetime import time
 
-from fastapi import Depends, APIRouter
-from starlette.responses import JSONResponse
+from fastapi import Depends, APIRouter, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import JSONResponse, StreamingResponse
 
-from server.database import Session
+from server.database import Session, get_session
 from server.api.models import (
     UpdatePasswordApiModel,
     NotificationTimeApiModel,
@@ -13,6 +15,7 @@ from server.api.models import (
     UserApiModel,
     Payload,
     UserIdApiModel,
+    MAX_PASSWORD_LENGTH,
 )
 from server.database.queries import (
     PasswordQueries,
@@ -21,14 +24,18 @@ from server.database.queries import (
     UserQueries,
 )
 from server.api import Authority
+from server.api.authority import TokenDenylist
+from server.utils.passwords import Passwords
 
 users_router = APIRouter(prefix="/users")
 
 
 @users_router.post("/", status_code=201)
-async def registration(user_api_model: UserApiModel):
-    async with Session.begin() as session:
-        await UserQueries.registration(session, user_api_model)
+async def registration(
+    user_api_model: UserApiModel,
+    session: Annotated[AsyncSession, Depends(get_session)],
+):
+    await UserQueries.registration(session, user_api_model)
 
 
 @users_router.post("/login")
@@ -36,63 +43,96 @@ async def user_auth(token: Annotated[Token, Depends(Authority.user_authenticate)
     return token
 
 
+def _ndjson_response(stream):
+    """
+    Rows of stream(session) are sent as NDJSON lines while read from database
+    """
+
+    async def lines():
+        async with Session.begin() as session:
+            async for row in stream(session):
+                yield json.dumps(row) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@users_router.get("/notifications")
+async def get_notifications_states():
+    return _ndjson_response(NotificationsQueries.stream_states)
+
+
 @users_router.get("/{user_id}")
-async def get_user(user_id: str):
-    async with Session.begin() as session:
-        return await UserQueries.get_user(
-            session, (await Authority.decrypt_message(user_id)).decode()
-        )
+async def get_user(
+    user_id: str, session: Annotated[AsyncSession, Depends(get_session)]
+):
+    return await UserQueries.get_user(
+        session, (await Authority.decrypt_message(user_id)).decode()
+    )
 
 
 @users_router.get("/")
 async def get_users():
-    async with Session.begin() as session:
-        return await UserQueries.get_users(session)
+    return _ndjson_response(UserQueries.stream_users)
 
 
 @users_router.put("/password")
-async def update_password(update_password_api_model: UpdatePasswordApiModel):
-    async with Session.begin() as session:
-        await PasswordQueries.update_password(session, update_password_api_model)
+async def update_password(
+    update_password_api_model: UpdatePasswordApiModel,
+    session: Annotated[AsyncSession, Depends(get_session)],
+):
+    password = await Authority.decrypt_message(update_password_api_model.password)
+    if password is None:
+        raise HTTPException(400, detail="Password is not encrypted by cipher")
+    password = password.decode()
+    if len(password) > MAX_PASSWORD_LENGTH:
+        raise HTTPException(
+            400, detail=f"Maximum password length is {MAX_PASSWORD_LENGTH}"
+        )
+    await PasswordQueries.update_password(
+        session, update_password_api_model.user_id, await Passwords.hash(password)
+    )
+    await TokenDenylist.revoke(session, update_password_api_model.user_id)
 
 
 @users_router.delete("/password")
 async def delete_password(
-    payload: Annotated[Payload, Depends(Authority.user_authorization)]
+    payload: Annotated[Payload, Depends(Authority.user_authorization)],
+    session: Annotated[AsyncSession, Depends(get_session)],
 ):
-    async with Session.begin() as session:
-        await PasswordQueries.delete_password(session, payload["sub"])
+    await PasswordQueries.delete_password(session, payload["sub"])
 
 
 @users_router.put("/email", status_code=201)
 async def update_email(
     email_api_model: EmailApiModel,
     payload: Annotated[Payload, Depends(Authority.user_authorization)],
+    session: Annotated[AsyncSession, Depends(get_session)],
 ):
-    async with Session.begin() as session:
-        await EmailQueries.update(session, payload["sub"], email_api_model.email)
+    await EmailQueries.update(session, payload["sub"], email_api_model.email)
 
 
 @users_router.delete("/email")
 async def delete_email(
-    payload: Annotated[Payload, Depends(Authority.user_authorization)]
+    payload: Annotated[Payload, Depends(Authority.user_authorization)],
+    session: Annotated[AsyncSession, Depends(get_session)],
 ):
-    async with Session.begin() as session:
-        await EmailQueries.delete(session, payload["sub"])
+    await EmailQueries.delete(session, payload["sub"])
 
 
 @users_router.patch("/notifications")
-async def invert_notifications(user_id_api_model: UserIdApiModel):
-    async with Session.begin() as session:
-        await NotificationsQueries.invert(session, user_id_api_model.user_id)
+async def invert_notifications(
+    user_id_api_model: UserIdApiModel,
+    session: Annotated[AsyncSession, Depends(get_session)],
+):
+    return await NotificationsQueries.invert(session, user_id_api_model.user_id)
 
 
 @users_router.put("/notifications")
 async def change_notification_time(
     time_: NotificationTimeApiModel,
     payload: Annotated[Payload, Depends(Authority.user_authorization)],
+    session: Annotated[AsyncSession, Depends(get_session)],
 ):
-    async with Session.begin() as session:
-        await NotificationsQueries.update(
-            session, payload["sub"], time(**time_.model_dump())
-        )
+    return await NotificationsQueries.update(
+        session, payload["sub"], time(**time_.model_dump())
+    )
@@ -0,0 +1,123 @@
+"""
+Query plans and timings of hot target queries without and with indexes.
+Seeds separate database habits_benchmark, main database is not touched.
+
+python -m server.benchmarks.indexes [users] [targets]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from sqlalchemy import text, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import server.api  # queries can't be imported before api, import is circular
+from server.database.models import Base, TargetORM
+from server.database.queries import TargetsQueries, ROLLOVER_BATCH_SIZE
+
+BENCHMARK_DATABASE = "habits_benchmark"
+# Set by migration 1209110d006a together with index, create_all doesn't set it
+TARGET_FILLFACTOR = "ALTER TABLE target SET (fillfactor = 80)"
+
+SEED_USERS = """
+INSERT INTO "user" (id, notifications, notification_time)
+SELECT 'u' || g, true, '15:00' FROM generate_series(1, :users) g
+"""
+SEED_TARGETS = """
+INSERT INTO target (name, user_id, progress, border_progress, completed, create_datetime)
+SELECT 'target', 'u' || (1 + g % :users), g % 22, 21, g % 3 = 0, now()
+FROM generate_series(1, :targets) g
+"""
+
+
+def _compile(statement):
+    return str(
+        statement.compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+    )
+
+
+async def _create_database():
+    engine = create_async_engine(
+        os.getenv("DATABASE") + "/postgres", isolation_level="AUTOCOMMIT"
+    )
+    async with engine.connect() as conn:
+        exists = (
+            await conn.execute(
+                text("SELECT 1 FROM pg_database WHERE datname = :name"),
+                {"name": BENCHMARK_DATABASE},
+            )
+        ).scalar()
+        if not exists:
+            await conn.execute(text(f"CREATE DATABASE {BENCHMARK_DATABASE}"))
+    await engine.dispose()
+
+
+async def _explain(conn, title: str, query: str):
+    # EXPLAIN ANALYZE executes data-modifying statements, so it is always rolled back
+    transaction = await conn.begin()
+    start = time.perf_counter()
+    plan = (await conn.execute(text(f"EXPLAIN ANALYZE {query}"))).scalars().all()
+    elapsed = time.perf_counter() - start
+    await transaction.rollback()
+    print(f"--- {title}: {elapsed * 1000:.1f} ms")
+    print("\n".join(plan))
+
+
+async def _explain_all(conn, user_id: str):
+    await _explain(
+        conn,
+        "get_targets",
+        _compile(
+            select(TargetORM)
+            .order_by(TargetORM.id)
+            .filter(TargetORM.user_id == user_id)
+        ),
+    )
+    await _explain(
+        conn,
+        "rollover batch",
+        _compile(
+            TargetsQueries._rollover_statement(
+                TargetORM.id > 0, TargetORM.id <= ROLLOVER_BATCH_SIZE
+            )
+        ),
+    )
+    await _explain(conn, "rollover", _compile(TargetsQueries._rollover_statement()))
+
+
+async def _seed(engine, users: int, targets: int, indexes: bool):
+    # Reseeded for every run, rolled back updates leave dead tuples behind
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        if not indexes:
+            for index in TargetORM.__table__.indexes:
+                await conn.run_sync(index.drop)
+        else:
+            await conn.execute(text(TARGET_FILLFACTOR))
+        await conn.execute(text(SEED_USERS), {"users": users})
+        await conn.execute(text(SEED_TARGETS), {"users": users, "targets": targets})
+        await conn.execute(text("ANALYZE target"))
+
+
+async def main(users: int = 10_000, targets: int = 1_000_000):
+    await _create_database()
+    engine = create_async_engine(os.getenv("DATABASE") + f"/{BENCHMARK_DATABASE}")
+    for indexes in (False, True):
+        await _seed(engine, users, targets, indexes)
+        async with engine.connect() as conn:
+            print(
+                f"=== {'With' if indexes else 'Without'} indexes"
+                f" ({users} users, {targets} targets)"
+            )
+            await _explain_all(conn, "u1")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,142 @@
+"""
+Latency of API requests under concurrent load and saturation of connection pool
+configured in [database]. Every request lists targets of user or inverts one.
+Seeds separate database habits_benchmark, main database is not touched.
+App is called in process, so latencies have no network in them.
+
+python -m server.benchmarks.load [requests] [concurrency]
+"""
+
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+import httpx
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from server.api import app, Authority
+from server.benchmarks.indexes import (
+    BENCHMARK_DATABASE,
+    TARGET_FILLFACTOR,
+    _create_database,
+)
+from server.database import Session, engine_options
+from server.database.models import Base
+
+USERS = 1000
+TARGETS_PER_USER = 10
+SAMPLE_SECONDS = 0.001
+SERVICE_HEADERS = {"x-service-name": "Psychological", "api-key": "benchmark"}
+
+SEED_USERS = """
+INSERT INTO "user" (id, notifications, notification_time, unfinished_targets)
+SELECT 'u' || g, true, '15:00', :targets FROM generate_series(1, :users) g
+"""
+SEED_TARGETS = """
+INSERT INTO target (name, user_id, progress, border_progress, completed, create_datetime)
+SELECT 'target', 'u' || (1 + g % :users), 0, 21, false, now()
+FROM generate_series(1, :targets) g
+"""
+SEED_SERVICE = """
+INSERT INTO service (id, api_key) VALUES ('Psychological', 'benchmark')
+"""
+
+
+async def _seed(engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(text(TARGET_FILLFACTOR))
+        await conn.execute(
+            text(SEED_USERS), {"users": USERS, "targets": TARGETS_PER_USER}
+        )
+        await conn.execute(
+            text(SEED_TARGETS), {"users": USERS, "targets": USERS * TARGETS_PER_USER}
+        )
+        await conn.execute(text(SEED_SERVICE))
+        await conn.execute(text("ANALYZE"))
+        rows = await conn.execute(text("SELECT id, user_id FROM target"))
+        return rows.all()
+
+
+def _headers(user_id: str):
+    token = Authority._encode_jwt(
+        {"sub": user_id, "exp": time.time() + 3600, "iat": time.time()}
+    )
+    return SERVICE_HEADERS | {"Authorization": f"Bearer {token}"}
+
+
+async def _sample_pool(pool, samples: list, stop: asyncio.Event):
+    while not stop.is_set():
+        samples.append(pool.checkedout())
+        await asyncio.sleep(SAMPLE_SECONDS)
+
+
+def _percentile(values: list, percent: int):
+    quantiles = statistics.quantiles(values, n=100, method="inclusive")
+    return quantiles[percent - 1] * 1000
+
+
+async def main(requests: int = 5000, concurrency: int = 50):
+    await _create_database()
+    engine = create_async_engine(
+        os.getenv("DATABASE") + f"/{BENCHMARK_DATABASE}", **engine_options
+    )
+    targets = await _seed(engine)
+    Session.configure(bind=engine)
+    headers = {user_id: _headers(user_id) for _, user_id in targets}
+
+    latencies, statuses, samples = [], [], []
+    limit = asyncio.Semaphore(concurrency)
+    capacity = engine_options["pool_size"] + engine_options["max_overflow"]
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://benchmark"
+    ) as client:
+
+        async def request():
+            target_id, user_id = random.choice(targets)
+            async with limit:
+                start = time.perf_counter()
+                if random.random() < 0.7:
+                    response = await client.get("/targets/", headers=headers[user_id])
+                else:
+                    response = await client.patch(
+                        f"/targets/{target_id}/invert", headers=headers[user_id]
+                    )
+                latencies.append(time.perf_counter() - start)
+                statuses.append(response.status_code)
+
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(_sample_pool(engine.pool, samples, stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(request() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await sampler
+
+    saturated = sum(checked_out >= capacity for checked_out in samples)
+    print(
+        f"=== {requests} requests, {concurrency} concurrent,"
+        f" pool {engine_options['pool_size']} + {engine_options['max_overflow']}"
+    )
+    print(
+        f"--- {requests / elapsed:.0f} requests/s,"
+        f" p50 {_percentile(latencies, 50):.1f} ms,"
+        f" p99 {_percentile(latencies, 99):.1f} ms,"
+        f" errors {sum(status >= 400 for status in statuses)}"
+    )
+    print(
+        f"--- pool: max {max(samples)} of {capacity} connections checked out,"
+        f" mean {statistics.mean(samples):.1f},"
+        f" saturated {saturated / len(samples) * 100:.0f}% of time"
+    )
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,84 @@
+"""
+Login latency under concurrent load with pbkdf2 verified inline in event loop
+and in process pool of Passwords. Every login waits for user lookup,
+LOOKUP_SECONDS, and verifies password. Meanwhile other requests are emulated
+by ticker, its lag shows how long event loop was blocked.
+
+python -m server.benchmarks.login [logins] [concurrency]
+"""
+
+import asyncio
+import statistics
+import sys
+import time
+
+from passlib.hash import pbkdf2_sha256
+
+from server.utils.passwords import Passwords, ROUNDS, SALT_SIZE, WORKERS
+
+LOOKUP_SECONDS = 0.002
+TICK_SECONDS = 0.005
+PASSWORD = "correct horse battery staple"
+
+
+async def _inline_verify(password: str, hash_: str):
+    return pbkdf2_sha256.verify(password, hash_)
+
+
+async def _pool_verify(password: str, hash_: str):
+    verified, _ = await Passwords.verify_and_update(password, hash_)
+    return verified
+
+
+async def _ticker(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(time.perf_counter() - start - TICK_SECONDS)
+
+
+def _percentile(values: list, percent: int):
+    quantiles = statistics.quantiles(values, n=100, method="inclusive")
+    return quantiles[percent - 1] * 1000
+
+
+async def _measure(title: str, verify, hash_: str, logins: int, concurrency: int):
+    latencies, lags = [], []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with limit:
+            start = time.perf_counter()
+            await asyncio.sleep(LOOKUP_SECONDS)
+            assert await verify(PASSWORD, hash_)
+            latencies.append(time.perf_counter() - start)
+
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(lags, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+    print(
+        f"--- {title}: {logins / elapsed:.0f} logins/s,"
+        f" login p50 {_percentile(latencies, 50):.0f} ms,"
+        f" p99 {_percentile(latencies, 99):.0f} ms,"
+        f" loop lag p99 {_percentile(lags, 99):.1f} ms, max {max(lags) * 1000:.1f} ms"
+    )
+
+
+async def main(logins: int = 200, concurrency: int = 20):
+    hash_ = pbkdf2_sha256.using(rounds=ROUNDS, salt_size=SALT_SIZE).hash(PASSWORD)
+    print(f"=== {logins} logins, {concurrency} concurrent, {ROUNDS} rounds")
+    # Processes of pool are started before measure
+    await asyncio.gather(*(Passwords.hash(PASSWORD) for _ in range(WORKERS)))
+    await _measure("Inline", _inline_verify, hash_, logins, concurrency)
+    await _measure(
+        f"Pool of {WORKERS} processes", _pool_verify, hash_, logins, concurrency
+    )
+    Passwords.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*map(int, sys.argv[1:])))
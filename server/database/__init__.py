@@ -5,6 +5,7 @@ from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from dotenv import load_dotenv, find_dotenv
 
 from server.database.models import Base
+from server.utils import config as server_config
 
 load_dotenv(find_dotenv())
 
@@ -12,10 +13,39 @@ config = ConfigParser()
 
 config.read(os.path.abspath(os.path.join(os.path.dirname(__file__), "alembic.ini")))
 
-engine = create_async_engine(os.getenv("DATABASE") + "/habits")
+engine_options = {
+    # pool_size connections are kept open, up to max_overflow more under load
+    "pool_size": server_config.getint("database", "POOL_SIZE"),
+    "max_overflow": server_config.getint("database", "MAX_OVERFLOW"),
+    # Seconds request waits for free connection before error
+    "pool_timeout": server_config.getint("database", "POOL_TIMEOUT"),
+    # Connections older than this are reopened, before server or proxy drops them
+    "pool_recycle": server_config.getint("database", "POOL_RECYCLE"),
+    # Connection is checked on checkout, so restarted database doesn't fail requests
+    "pool_pre_ping": server_config.getboolean("database", "POOL_PRE_PING"),
+    "connect_args": {
+        # Prepared statements per connection, asyncpg skips parse and plan of them
+        "prepared_statement_cache_size": server_config.getint(
+            "database", "STATEMENT_CACHE_SIZE"
+        ),
+    },
+}
+
+engine = create_async_engine(os.getenv("DATABASE") + "/habits", **engine_options)
 Session = async_sessionmaker(engine, expire_on_commit=False)
 
 
+async def get_session():
+    """
+    Dependency, one session per request.
+    Dependencies and handler of request get the same session,
+    it is committed after handler returns and rolled back if it raises.
+    """
+    async with Session() as session:
+        yield session
+        await session.commit()
+
+
 async def create_all():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
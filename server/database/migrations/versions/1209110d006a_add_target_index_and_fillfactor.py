@@ -0,0 +1,40 @@
+"""add target user_id id index and fillfactor
+
+Revision ID: 1209110d006a
+Revises: 29add538c39d
+Create Date: 2026-10-18 11:03:17.904312
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "1209110d006a"
+down_revision: Union[str, None] = "29add538c39d"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Free space in pages lets daily rollover do HOT updates (new pages only)
+    op.execute("ALTER TABLE target SET (fillfactor = 80)")
+    # CONCURRENTLY can`t run inside transaction, but it doesn`t lock target for writes
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_target_user_id_id",
+            "target",
+            ["user_id", "id"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_target_user_id_id", table_name="target", postgresql_concurrently=True
+        )
+    op.execute("ALTER TABLE target RESET (fillfactor)")
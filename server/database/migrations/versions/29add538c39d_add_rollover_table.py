@@ -0,0 +1,33 @@
+"""add rollover table
+
+Revision ID: 29add538c39d
+Revises: fab5ab4e58ca
+Create Date: 2026-10-18 10:12:41.310527
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "29add538c39d"
+down_revision: Union[str, None] = "fab5ab4e58ca"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "rollover",
+        sa.Column("date", sa.Date(), nullable=False),
+        sa.Column("last_target_id", sa.Integer(), nullable=False),
+        sa.Column("finished", sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint("date"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("rollover")
@@ -0,0 +1,42 @@
+"""add user unfinished targets
+
+Revision ID: 5c0e8a31d7b2
+Revises: 1209110d006a
+Create Date: 2026-10-18 16:40:12.204519
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5c0e8a31d7b2"
+down_revision: Union[str, None] = "1209110d006a"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "user",
+        sa.Column(
+            "unfinished_targets", sa.Integer(), server_default="0", nullable=False
+        ),
+    )
+    op.execute(
+        """
+        UPDATE "user" SET unfinished_targets = unfinished.count
+        FROM (
+            SELECT user_id, count(*) AS count FROM target
+            WHERE completed IS NOT true GROUP BY user_id
+        ) AS unfinished
+        WHERE "user".id = unfinished.user_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("user", "unfinished_targets")
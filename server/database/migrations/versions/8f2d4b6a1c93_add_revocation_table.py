@@ -0,0 +1,32 @@
+"""add revocation table
+
+Revision ID: 8f2d4b6a1c93
+Revises: 5c0e8a31d7b2
+Create Date: 2026-10-18 22:05:37.518204
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8f2d4b6a1c93"
+down_revision: Union[str, None] = "5c0e8a31d7b2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "revocation",
+        sa.Column("user_id", sa.VARCHAR(length=20), nullable=False),
+        sa.Column("revoked_at", sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint("user_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("revocation")
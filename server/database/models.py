@@ -8,7 +8,10 @@ from sqlalchemy import (
     Time,
     Integer,
     DateTime,
+    Date,
+    Float,
     ForeignKey,
+    Index,
 )
 from sqlalchemy.orm import DeclarativeBase, relationship
 
@@ -34,6 +37,8 @@ class UserORM(Base):
     email = Column(VARCHAR(MAX_EMAIL_LENGTH), nullable=True, unique=True)
     notifications = Column(Boolean, default=True)
     notification_time = Column(Time, default=time(DEFAULT_REMAINING_HOUR, 0))
+    # Targets with completed not true, kept by TargetsQueries on every change
+    unfinished_targets = Column(Integer, default=0, server_default="0", nullable=False)
 
     targets = relationship("TargetORM")
 
@@ -62,6 +67,11 @@ class TargetORM(Base):
 
     user_id = Column(VARCHAR(ID_MAX_LENGTH), ForeignKey("user.id"), nullable=False)
 
+    # Rollover columns (completed, progress) are not indexed on purpose and pages
+    # keep free space (fillfactor 80, set by migration 1209110d006a): so daily
+    # rollover updates are HOT and don`t touch indexes
+    __table_args__ = (Index("ix_target_user_id_id", user_id, id),)
+
     def as_dict_(self):
         data = {}
         for column in self.__table__.columns:
@@ -81,3 +91,17 @@ class ServiceORM(Base):
     __tablename__ = "service"
     id = Column(VARCHAR(ID_MAX_LENGTH), primary_key=True)
     api_key = Column(String, nullable=False)
+
+
+class RolloverORM(Base):
+    __tablename__ = "rollover"
+    date = Column(Date, primary_key=True)
+    last_target_id = Column(Integer, default=0, nullable=False)
+    finished = Column(Boolean, default=False, nullable=False)
+
+
+class RevocationORM(Base):
+    __tablename__ = "revocation"
+    user_id = Column(VARCHAR(ID_MAX_LENGTH), primary_key=True)
+    # Unix time, tokens of user issued before it are rejected
+    revoked_at = Column(Float, nullable=False)
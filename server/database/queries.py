@@ -1,15 +1,36 @@
-from datetime import datetime
+from datetime import datetime, date
 from typing import Any, List
 
-from sqlalchemy import update, insert, select, delete, and_
+from sqlalchemy import (
+    update,
+    insert,
+    select,
+    delete,
+    and_,
+    or_,
+    case,
+    func,
+    bindparam,
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException
 
 
-from server.api.models import UserApiModel, UpdatePasswordApiModel
+from server.api.models import UserApiModel
 from server.database import Session
-from server.database.models import UserORM, TargetORM, ServiceORM
+from server.database.models import (
+    UserORM,
+    TargetORM,
+    ServiceORM,
+    RolloverORM,
+    RevocationORM,
+)
+from server.utils import config
+
+ROLLOVER_BATCH_SIZE = config.getint("rollover", "ROLLOVER_BATCH_SIZE")
+STREAM_YIELD_PER = config.getint("limitations", "STREAM_YIELD_PER")
 
 
 class ServiceQueries:
@@ -35,11 +56,15 @@ class UserQueries:
             raise HTTPException(409, "User already exists")
 
     @staticmethod
-    async def get_users(session: AsyncSession):
-        return [
-            user.as_dict_()
-            for user in (await session.execute(select(UserORM))).scalars()
-        ]
+    async def stream_users(session: AsyncSession):
+        """
+        Users by server-side cursor, only STREAM_YIELD_PER rows are held in memory.
+        """
+        users = await session.stream_scalars(
+            select(UserORM).execution_options(yield_per=STREAM_YIELD_PER)
+        )
+        async for user in users:
+            yield user.as_dict_()
 
     @staticmethod
     async def get_user(session: AsyncSession, user_id: str):
@@ -51,13 +76,20 @@ class UserQueries:
 
 class PasswordQueries:
     @staticmethod
-    async def update_password(
-        session: AsyncSession, update_password_api_model: UpdatePasswordApiModel
+    async def update_password(session: AsyncSession, user_id: str, hash_: str):
+        await session.execute(
+            update(UserORM).where(UserORM.id == user_id).values({"hash": hash_})
+        )
+
+    @staticmethod
+    async def rehash_password(
+        session: AsyncSession, user_id: str, old_hash: str, new_hash: str
     ):
+        # Password changed meanwhile is not overwritten by rehash of old one
         await session.execute(
             update(UserORM)
-            .where(UserORM.id == update_password_api_model.user_id)
-            .values({"hash": update_password_api_model.hash})
+            .where(UserORM.id == user_id, UserORM.hash == old_hash)
+            .values({"hash": new_hash})
         )
 
     @staticmethod
@@ -67,6 +99,34 @@ class PasswordQueries:
         )
 
 
+class RevocationQueries:
+    @staticmethod
+    async def revoke(
+        session: AsyncSession, user_id: str, revoked_at: float, expired_before: float
+    ):
+        # Tokens issued before expired_before are expired, so are their revocations
+        await session.execute(
+            delete(RevocationORM).where(RevocationORM.revoked_at < expired_before)
+        )
+        await session.execute(
+            pg_insert(RevocationORM)
+            .values(user_id=user_id, revoked_at=revoked_at)
+            .on_conflict_do_update(
+                index_elements=[RevocationORM.user_id],
+                set_={"revoked_at": revoked_at},
+            )
+        )
+
+    @staticmethod
+    async def get_revocations(session: AsyncSession, since: float):
+        rows = await session.execute(
+            select(RevocationORM.user_id, RevocationORM.revoked_at).where(
+                RevocationORM.revoked_at >= since
+            )
+        )
+        return dict(rows.all())
+
+
 class EmailQueries:
     @staticmethod
     async def update(session: AsyncSession, user_id: str, email: str):
@@ -82,6 +142,42 @@ class EmailQueries:
 
 
 class NotificationsQueries:
+    # Everything bot needs to decide on reminders of user
+    _state_columns = (
+        UserORM.id,
+        UserORM.notifications,
+        UserORM.notification_time,
+        UserORM.unfinished_targets,
+    )
+
+    @staticmethod
+    def _state(user):
+        return {
+            "id": user.id,
+            "notifications": user.notifications,
+            "notification_time": {
+                "hour": user.notification_time.hour,
+                "minute": user.notification_time.minute,
+            },
+            "unfinished_targets": user.unfinished_targets,
+        }
+
+    @classmethod
+    async def _update_returning_state(
+        cls, session: AsyncSession, user_id: str, values: dict
+    ):
+        user = (
+            await session.execute(
+                update(UserORM)
+                .where(UserORM.id == user_id)
+                .values(values)
+                .returning(*cls._state_columns)
+            )
+        ).one_or_none()
+        if user is None:
+            raise HTTPException(404)
+        return cls._state(user)
+
     @staticmethod
     async def on(session: AsyncSession, user_id: str):
         return (
@@ -90,30 +186,53 @@ class NotificationsQueries:
             )
         ).scalar()
 
-    @staticmethod
-    async def update(session: AsyncSession, user_id: str, time):
-        await session.execute(
-            update(UserORM)
-            .values({"notification_time": time})
-            .where(UserORM.id == user_id)
+    @classmethod
+    async def update(cls, session: AsyncSession, user_id: str, time):
+        return await cls._update_returning_state(
+            session, user_id, {"notification_time": time}
         )
 
-    @staticmethod
-    async def invert(session: AsyncSession, user_id: str):
-        notifications = (
-            await session.execute(
-                select(UserORM.notifications).where(UserORM.id == user_id)
-            )
-        ).scalar()
-        await session.execute(
-            update(UserORM)
-            .where(UserORM.id == user_id)
-            .values({"notifications": not notifications})
+    @classmethod
+    async def invert(cls, session: AsyncSession, user_id: str):
+        return await cls._update_returning_state(
+            session, user_id, {"notifications": UserORM.notifications.isnot(True)}
         )
-        return 0 if notifications else 1
+
+    @classmethod
+    async def add_unfinished_targets(
+        cls, session: AsyncSession, user_id: str, count: int
+    ):
+        return await cls._update_returning_state(
+            session,
+            user_id,
+            {"unfinished_targets": UserORM.unfinished_targets + count},
+        )
+
+    @classmethod
+    async def get_states(cls, session: AsyncSession, user_ids: List[str]):
+        users = await session.execute(
+            select(*cls._state_columns).filter(UserORM.id.in_(user_ids))
+        )
+        return [cls._state(user) for user in users]
+
+    @classmethod
+    async def stream_states(cls, session: AsyncSession):
+        """
+        Notifications state of every user on server-side cursor
+        """
+        result = await session.stream(
+            select(*cls._state_columns).execution_options(yield_per=STREAM_YIELD_PER)
+        )
+        async for user in result:
+            yield cls._state(user)
 
 
 class TargetsQueries:
+    # Create, delete and invert_completed keep user unfinished_targets
+    # and return notifications state of user.
+    # Update, delete and invert_completed touch only target of user_id,
+    # if there is no such target they raise 404
+
     @staticmethod
     async def create(
         session: AsyncSession,
@@ -130,10 +249,22 @@ class TargetsQueries:
                 border_progress=border_progress,
             )
         )
+        return await NotificationsQueries.add_unfinished_targets(session, user_id, 1)
 
     @staticmethod
-    async def delete(session: AsyncSession, target_id: int):
-        await session.execute(delete(TargetORM).where(TargetORM.id == target_id))
+    async def delete(session: AsyncSession, user_id: str, target_id: int):
+        target = (
+            await session.execute(
+                delete(TargetORM)
+                .where(TargetORM.id == target_id, TargetORM.user_id == user_id)
+                .returning(TargetORM.completed)
+            )
+        ).one_or_none()
+        if target is None:
+            raise HTTPException(404)
+        return await NotificationsQueries.add_unfinished_targets(
+            session, user_id, 0 if target.completed else -1
+        )
 
     @staticmethod
     async def get_targets(session: AsyncSession, user_id: str):
@@ -148,6 +279,54 @@ class TargetsQueries:
             ).scalars()
         ]
 
+    @staticmethod
+    async def get_targets_page(
+        session: AsyncSession,
+        user_id: str,
+        limit: int,
+        after_id: int | None = None,
+        before_id: int | None = None,
+    ):
+        """
+        Keyset pagination by target id. With before_id page is taken backward.
+        Also returns totals of user targets and existence of neighbour pages.
+        """
+        query = select(TargetORM).filter(TargetORM.user_id == user_id)
+        if after_id is not None:
+            query = query.filter(TargetORM.id > after_id)
+        if before_id is not None:
+            query = query.filter(TargetORM.id < before_id).order_by(TargetORM.id.desc())
+        else:
+            query = query.order_by(TargetORM.id)
+        targets = [
+            target.as_dict_()
+            for target in (await session.execute(query.limit(limit))).scalars()
+        ]
+        if before_id is not None:
+            targets.reverse()
+
+        first_id = targets[0]["id"] if targets else 0
+        last_id = targets[-1]["id"] if targets else 0
+        total, achieved, before, after = (
+            await session.execute(
+                select(
+                    func.count(),
+                    func.count().filter(
+                        TargetORM.progress == TargetORM.border_progress
+                    ),
+                    func.count().filter(TargetORM.id < first_id),
+                    func.count().filter(TargetORM.id > last_id),
+                ).filter(TargetORM.user_id == user_id)
+            )
+        ).one()
+        return {
+            "targets": targets,
+            "total": total,
+            "achieved": achieved,
+            "has_before": bool(targets) and before > 0,
+            "has_after": bool(targets) and after > 0,
+        }
+
     @staticmethod
     async def get_target(session: AsyncSession, target_id: int):
         target = await session.get(TargetORM, ident=target_id)
@@ -156,54 +335,170 @@ class TargetsQueries:
         return target.as_dict_()
 
     @staticmethod
-    async def update(session: AsyncSession, target_id: int, **kwargs):
-        kwargs = {k: v for k, v in kwargs.items() if v is not None}
-        await session.execute(
-            update(TargetORM).values(kwargs).filter(TargetORM.id == target_id)
-        )
+    async def update(session: AsyncSession, user_id: str, target_id: int, **kwargs):
+        # Without changes id is set to itself, so missing target is still 404
+        kwargs = {k: v for k, v in kwargs.items() if v is not None} or {
+            "id": TargetORM.id
+        }
+        updated = (
+            await session.execute(
+                update(TargetORM)
+                .values(kwargs)
+                .filter(TargetORM.id == target_id, TargetORM.user_id == user_id)
+                .returning(TargetORM.id)
+            )
+        ).one_or_none()
+        if updated is None:
+            raise HTTPException(404)
 
     @staticmethod
-    async def invert_completed(session: AsyncSession, target_id: int):
-        completed = (
+    async def invert_completed(session: AsyncSession, user_id: str, target_id: int):
+        target = (
             await session.execute(
-                select(TargetORM.completed).filter(TargetORM.id == target_id)
+                update(TargetORM)
+                .values({"completed": TargetORM.completed.isnot(True)})
+                .filter(TargetORM.id == target_id, TargetORM.user_id == user_id)
+                .returning(TargetORM.completed)
             )
-        ).scalar()
-
-        await session.execute(
-            update(TargetORM)
-            .values({"completed": not completed})
-            .filter(TargetORM.id == target_id)
+        ).one_or_none()
+        if target is None:
+            raise HTTPException(404)
+        return await NotificationsQueries.add_unfinished_targets(
+            session, user_id, -1 if target.completed else 1
         )
-        return 1 if completed else 0
 
     @staticmethod
-    async def increase_progress():
-        async with Session.begin() as session:
-            await session.execute(
-                update(TargetORM)
-                .values({"progress": TargetORM.progress + 1})
-                .filter(
-                    TargetORM.progress + 1 <= TargetORM.border_progress,
-                    TargetORM.completed,
-                )
+    def _rollover_statement(*criteria):
+        """
+        Daily transition of targets in one pass (SET expressions see old values):
+        1) Completed target increases progress, if border not reached yet
+        2) Target stays completed only on border, otherwise marked as uncompleted
+        3) Target on border gets completed datetime
+        Rows which state not changes are not touched.
+        Returns per user count of reopened targets (completed before,
+        not completed now), only users with reopened targets.
+        """
+        completed = TargetORM.completed.is_(True)
+        increase = and_(completed, TargetORM.progress < TargetORM.border_progress)
+        reach_border = or_(
+            TargetORM.progress == TargetORM.border_progress,
+            and_(completed, TargetORM.progress + 1 == TargetORM.border_progress),
+        )
+        rolled = (
+            update(TargetORM)
+            .values(
+                {
+                    "progress": case(
+                        (increase, TargetORM.progress + 1), else_=TargetORM.progress
+                    ),
+                    "completed": and_(completed, reach_border),
+                    "completed_datetime": case(
+                        (
+                            and_(TargetORM.completed_datetime.is_(None), reach_border),
+                            datetime.now(),
+                        ),
+                        else_=TargetORM.completed_datetime,
+                    ),
+                }
+            )
+            .filter(
+                or_(
+                    and_(completed, TargetORM.progress != TargetORM.border_progress),
+                    and_(
+                        TargetORM.progress == TargetORM.border_progress,
+                        TargetORM.completed_datetime.is_(None),
+                    ),
+                ),
+                *criteria,
             )
+            .returning(
+                TargetORM.user_id,
+                # RETURNING sees new values, only reopened rows are off border
+                and_(
+                    TargetORM.completed.isnot(True),
+                    TargetORM.progress != TargetORM.border_progress,
+                ).label("reopened"),
+            )
+            .cte("rolled")
+        )
+        return (
+            select(rolled.c.user_id, func.count().label("reopened"))
+            .filter(rolled.c.reopened)
+            .group_by(rolled.c.user_id)
+        )
 
+    @classmethod
+    async def increase_progress(cls, batch_size: int = ROLLOVER_BATCH_SIZE):
+        """
+        Rollover runs once per calendar day over primary key ranges of targets.
+        Range, its checkpoint and reopened targets of users are committed in one
+        transaction, so interrupted rollover resumes from the last processed id
+        without double increase.
+        After every committed range yields notifications states of users
+        with reopened targets in it, only their reminders can change.
+        batch_size 0 means all targets in one range.
+        """
+        today = date.today()
         async with Session.begin() as session:
             await session.execute(
-                update(TargetORM)
-                .values({"completed": False})
-                .filter(TargetORM.progress != TargetORM.border_progress)
+                pg_insert(RolloverORM)
+                .values(date=today, last_target_id=0, finished=False)
+                .on_conflict_do_nothing()
             )
 
-        async with Session.begin() as session:
-            await session.execute(
-                update(TargetORM)
-                .values({"completed_datetime": datetime.now()})
-                .filter(
-                    and_(
-                        TargetORM.progress == TargetORM.border_progress,
-                        TargetORM.completed_datetime.is_(None),
+        while True:
+            async with Session.begin() as session:
+                rollover = (
+                    await session.execute(
+                        select(RolloverORM)
+                        .filter(RolloverORM.date == today)
+                        .with_for_update()
                     )
-                )
-            )
+                ).scalar_one()
+                if rollover.finished:
+                    break
+
+                last_target_id = None
+                if batch_size:
+                    last_target_id = (
+                        await session.execute(
+                            select(TargetORM.id)
+                            .filter(TargetORM.id > rollover.last_target_id)
+                            .order_by(TargetORM.id)
+                            .offset(batch_size - 1)
+                            .limit(1)
+                        )
+                    ).scalar()
+
+                criteria = [TargetORM.id > rollover.last_target_id]
+                if last_target_id is not None:
+                    criteria.append(TargetORM.id <= last_target_id)
+                reopened = [
+                    {"user_id": row.user_id, "reopened": row.reopened}
+                    for row in await session.execute(
+                        cls._rollover_statement(*criteria)
+                    )
+                ]
+                states = []
+                if reopened:
+                    users = UserORM.__table__
+                    await session.execute(
+                        update(users)
+                        .where(users.c.id == bindparam("user_id"))
+                        .values(
+                            unfinished_targets=users.c.unfinished_targets
+                            + bindparam("reopened")
+                        ),
+                        reopened,
+                    )
+                    states = await NotificationsQueries.get_states(
+                        session, [row["user_id"] for row in reopened]
+                    )
+
+                if last_target_id is None:
+                    rollover.finished = True
+                else:
+                    rollover.last_target_id = last_target_id
+            # Only committed changes are reported
+            for state in states:
+                yield state
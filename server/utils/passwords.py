@@ -0,0 +1,68 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.hash import pbkdf2_sha256
+
+from server.utils import config
+
+ROUNDS = config.getint("passwords", "ROUNDS")
+SALT_SIZE = config.getint("passwords", "SALT_SIZE")
+WORKERS = config.getint("passwords", "WORKERS")
+MAX_PENDING = config.getint("passwords", "MAX_PENDING")
+
+_hasher = pbkdf2_sha256.using(rounds=ROUNDS, salt_size=SALT_SIZE)
+
+
+def _hash(password: str):
+    return _hasher.hash(password)
+
+
+def _verify_and_update(password: str, hash_: str):
+    if not _hasher.verify(password, hash_):
+        return False, None
+    # needs_update compares rounds only, salt size is checked here
+    if _hasher.needs_update(hash_) or len(_hasher.from_string(hash_).salt) != SALT_SIZE:
+        return True, _hasher.hash(password)
+    return True, None
+
+
+class Passwords:
+    """
+    pbkdf2 is slow on purpose, so it is computed in pool of WORKERS processes
+    instead of event loop. No more than MAX_PENDING calls wait for pool,
+    others wait for free slot here.
+    Hashes with cost other than ROUNDS and SALT_SIZE are rehashed on verify.
+    """
+
+    _pool: ProcessPoolExecutor | None = None
+    _pending = asyncio.Semaphore(MAX_PENDING)
+
+    @classmethod
+    def _executor(cls):
+        if cls._pool is None:
+            cls._pool = ProcessPoolExecutor(max_workers=WORKERS)
+        return cls._pool
+
+    @classmethod
+    async def _run(cls, function, *args):
+        async with cls._pending:
+            return await asyncio.get_running_loop().run_in_executor(
+                cls._executor(), function, *args
+            )
+
+    @classmethod
+    async def hash(cls, password: str):
+        return await cls._run(_hash, password)
+
+    @classmethod
+    async def verify_and_update(cls, password: str, hash_: str):
+        """
+        Returns (verified, new hash), new hash is None if stored one is up to date
+        """
+        return await cls._run(_verify_and_update, password, hash_)
+
+    @classmethod
+    def shutdown(cls):
+        if cls._pool is not None:
+            cls._pool.shutdown(cancel_futures=True)
+            cls._pool = None